@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from obdlink import format_response, check_send_result, AdapterTimeout, _is_pending_response
+
+class AsyncAdapter:
+    """
+    asyncio front end for an ELM327/OBDLink.
+
+    A reader task collects everything the adapter sends and hands each ">"-terminated response
+    to the command waiting for it, while a writer task drains a queue of commands, sending the
+    next one as soon as the prompt for the previous one arrives. Callers just await a future.
+    """
+
+    # Serial read timeout while the reader task owns the port, so it can notice a shutdown
+    poll_interval = 0.05
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.loop = None
+        self._queue = None
+        self._tasks = []
+        self._pending = None
+        self._closing = False
+        self._thread = None
+        self._io = None
+        self._saved_timeout = None
+
+    async def start(self):
+        ser = self.adapter.ser
+        if not ser or not ser.is_open:
+            raise ConnectionError("Serial port is not open.")
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        # One thread for the blocking reads, one for writes
+        self._io = ThreadPoolExecutor(max_workers=2, thread_name_prefix="adapter-io")
+        self._saved_timeout = ser.timeout
+        ser.timeout = self.poll_interval
+        self._closing = False
+        self._tasks = [self.loop.create_task(self._reader()), self.loop.create_task(self._writer())]
+        self.adapter._async = self
+        return self
+
+    async def stop(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._io.shutdown(wait=True)
+        self.adapter.ser.timeout = self._saved_timeout
+        if self.adapter._async is self:
+            self.adapter._async = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def start_in_thread(self):
+        # Run the event loop in a daemon thread so synchronous code can share the port
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            ready.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="adapter-loop", daemon=True)
+        self._thread.start()
+        ready.wait()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+        return self
+
+    def stop_thread(self):
+        if self._thread is None:
+            raise RuntimeError("Adapter loop was started with start(), await stop() instead")
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self._thread = None
+
+    def call(self, coro):
+        # Blocking bridge used by the synchronous ELM327 methods
+        if self._thread is None or threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("Synchronous adapter call from the adapter's event loop, await it instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def write_commands(self, commands: list, expect_echo: bool = True) -> list:
+        # Commands in one call are sent back-to-back, nothing else gets in between
+        fut = self.loop.create_future()
+        await self._queue.put((commands, expect_echo, fut))
+        return await fut
+
+    async def write_command(self, command: str, expect_echo: bool = True) -> str:
+        return (await self.write_commands([command], expect_echo))[0]
+
+    async def write_obd(self, header: bytes | int, data: bytes) -> bytes:
+        if self.adapter._software_isotp(data):
+            raise RuntimeError("Multi-frame requests need the port to themselves, stop the background loop first")
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.adapter._obd_result(await self.write_commands(self.adapter._obd_commands(header, data)))
+            retry = self.adapter._retry_timeout(header, response)
+            if retry is not None:
+                response = self.adapter._obd_result(
+                    await self.write_commands(self.adapter._obd_commands(header, data, timeout=retry)))
+            pending = _is_pending_response(response)
+            if pending:
+                # Same as ELM327.write_obd: again, listening past response pending for up to P2*
+                self.adapter._check_repeatable(header, data)
+                wait = self.adapter.pending_timeout
+                deadline = time.monotonic() + wait
+                while _is_pending_response(response) and time.monotonic() < deadline:
+                    response = self.adapter._obd_result(await self.write_commands(
+                        self.adapter._obd_commands(header, data, timeout=wait, responses=2)))
+            self.adapter._check_response(header, data, response, start, observe=not pending)
+            return response
+        finally:
+            if self.adapter.hooks:
+                self.adapter._emit_request(header, data, start, response)
+
+    async def send_obd(self, header: bytes | int, data: bytes):
+        if self.adapter._software_isotp(data):
+            raise RuntimeError("Multi-frame requests need the port to themselves, stop the background loop first")
+        start = time.perf_counter()
+        try:
+            check_send_result(await self.write_commands(self.adapter._obd_commands(header, data, expect_response=False)))
+        finally:
+            if self.adapter.hooks:
+                self.adapter._emit_request(header, data, start, None)
+
+    async def _writer(self):
+        while True:
+            commands, expect_echo, fut = await self._queue.get()
+            if fut.done():
+                continue  # Caller gave up
+            try:
+                responses = []
+                for command in commands:
+                    # Commands go out in queue order here, so this is where repeated settings are dropped
+                    if self.adapter._setting_unchanged(command):
+                        responses.append("OK")
+                        continue
+                    responses.append(await self._exchange(command, expect_echo))
+                    self.adapter._setting_sent(command, responses[-1])
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(responses)
+
+    async def _exchange(self, command: str, expect_echo: bool) -> str:
+        self._pending = self.loop.create_future()
+        t0 = time.perf_counter()
+        try:
+            await self.loop.run_in_executor(self._io, self.adapter.ser.write, (command + '\r\n').encode('utf-8'))
+            t1 = time.perf_counter()
+            try:
+                raw = await asyncio.wait_for(self._pending, self.adapter.command_timeout)
+            except asyncio.TimeoutError:
+                raise AdapterTimeout(f"No prompt from the adapter within {self.adapter.command_timeout}s after {command!r}")
+            t2 = time.perf_counter()
+        finally:
+            self._pending = None
+        if expect_echo and b"\r" in raw:
+            raw = raw.split(b"\r", 1)[1]
+        resp = format_response(raw)
+        if self.adapter.hooks:
+            # The reader takes echo and response together, so echo time is counted as prompt wait
+            self.adapter._emit_command(command, t0, (t1 - t0, 0.0, t2 - t1, time.perf_counter() - t2))
+        return resp
+
+    def _read_chunk(self) -> bytes:
+        ser = self.adapter.ser
+        return ser.read(ser.in_waiting or 1)
+
+    async def _reader(self):
+        buf = bytearray()
+        try:
+            while not self._closing:
+                chunk = await self.loop.run_in_executor(self._io, self._read_chunk)
+                if not chunk:
+                    continue
+                buf += chunk
+                while (end := buf.find(b">")) >= 0:
+                    raw = bytes(buf[:end + 1])
+                    del buf[:end + 1]
+                    if self._pending is not None and not self._pending.done():
+                        self._pending.set_result(raw)
+                    # A prompt nobody asked for (e.g. after an adapter reset) is dropped
+        except Exception as e:
+            if self._pending is not None and not self._pending.done():
+                self._pending.set_exception(e)
+            raise
@@ -0,0 +1,149 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import mdx
+from decode import compile_decoders
+from obdlink import ELM327, OBDLink, UDS, CANError
+from sim import SimulatedAdapter, SimulatedECU
+from dtc import DTCWatcher
+
+DEFAULT_MDX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DSPU5T-14H474-GAC_1713367915000.MDX")
+
+def _time(fn, repeat: int, number: int = 1) -> dict:
+    # Per-call seconds over `repeat` samples of `number` calls each
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {"min": min(samples), "median": statistics.median(samples), "repeat": repeat, "number": number}
+
+def _sim_uds(parsed, stn: bool = True):
+    ecu = SimulatedECU(parsed, dtcs={code: 0x09 for code in list(parsed["dtcs"])[:4]})
+    elm = OBDLink(None)
+    elm.connect(SimulatedAdapter({0x716: ecu}, stn=stn))
+    elm.defaults()
+    return UDS(elm)
+
+def _sim_elm327_uds(parsed):
+    # Plain ELM327, multi-frame messages through the software ISO-TP layer
+    elm = ELM327(None, 38400)
+    elm.connect(SimulatedAdapter({0x716: SimulatedECU(parsed)}, stn=False))
+    elm.defaults()
+    elm.configure_isotp(parsed["protocol"]["network"])
+    return UDS(elm)
+
+def scenarios(mdx_path: str, cache_dir: str):
+    # name -> (callable, repeat, number). Setup happens here, outside the timed region.
+    parsed = mdx.parse_mdx(mdx_path)
+    mdx.load_mdx(mdx_path, cache_dir)
+    codes = list(parsed["dtcs"])
+    sessions = ["session_01", "session_02", "session_03", "session_61"]
+    decoders = compile_decoders(parsed)
+    raws = [(d, bytes(d.size)) for d in decoders.values()]
+    sizes = mdx.did_sizes(parsed)
+    dids = list(sizes)
+    diag = _sim_uds(parsed)
+    watcher = DTCWatcher(diag, 0x716, full_every=1 << 30)
+    watcher.poll()
+
+    elm327 = _sim_elm327_uds(parsed)
+
+    def full_dump():
+        diag.read_data_by_identifiers(0x716, dids, sizes, parsed["protocol"]["max_dids_per_request"])
+
+    def full_dump_elm327():
+        elm327.read_data_by_identifiers(0x716, dids, sizes, parsed["protocol"]["max_dids_per_request"])
+
+    def single_dump():
+        for did in dids:
+            try:
+                diag.read_data_by_identifier(0x716, did)
+            except (ValueError, CANError):
+                pass
+
+    return {
+        "parse_cold": (lambda: mdx.parse_mdx(mdx_path), 5, 1),
+        "parse_stream": (lambda: mdx.parse_mdx(mdx_path, stream=True), 5, 1),
+        "parse_warm": (lambda: mdx.load_mdx(mdx_path, cache_dir), 20, 1),
+        "interpret_dtc": (lambda: [mdx.interpret_dtc(parsed, c) for c in codes], 20, 10),
+        "list_accessible_dids": (lambda: [mdx.list_accessible_dids(parsed, s) for s in sessions], 20, 10),
+        "decode_all_dids": (lambda: [d.decode(r) for d, r in raws], 20, 10),
+        "write_command": (lambda: diag.adapter.write_command("ATRV"), 20, 100),
+        "write_obd": (lambda: diag.adapter.write_obd(0x716, b"\x22\xD1\x11"), 20, 100),
+        "ecu_dump_batched": (full_dump, 10, 1),
+        "ecu_dump_batched_elm327": (full_dump_elm327, 10, 1),
+        "ecu_dump_single": (single_dump, 10, 1),
+        "read_dtcs": (lambda: diag.read_dtcs(0x716), 20, 10),
+        "dtc_watch_poll": (watcher.poll, 20, 10),
+    }
+
+def run(mdx_path: str = DEFAULT_MDX, only: list | None = None) -> dict:
+    results = {}
+    # Scratch MDX cache for parse_warm, gone again once the run is over
+    with tempfile.TemporaryDirectory(prefix="fdiag-bench-") as cache_dir:
+        for name, (fn, repeat, number) in scenarios(mdx_path, cache_dir).items():
+            if only and name not in only:
+                continue
+            fn()  # Warm up
+            results[name] = _time(fn, repeat, number)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mdx": os.path.basename(mdx_path),
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.25) -> list:
+    # Scenarios whose median got slower than baseline by more than `tolerance` (0.25 = 25%)
+    regressions = []
+    for name, base in baseline["results"].items():
+        cur = current["results"].get(name)
+        if cur is None or not base["median"]:
+            continue
+        ratio = cur["median"] / base["median"]
+        if ratio > 1 + tolerance:
+            regressions.append((name, base["median"], cur["median"], ratio))
+    return regressions
+
+def _fmt(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    def option(flag, default=None):
+        if flag in args:
+            idx = args.index(flag) + 1
+            return args[idx] if idx < len(args) else default
+        return default
+
+    if "--help" in args:
+        print("Usage: bench.py [--mdx PATH] [--only name,name] [--json OUT] [--baseline FILE] [--tolerance 0.25]")
+        sys.exit(0)
+    only = option("--only")
+    report = run(option("--mdx", DEFAULT_MDX), only.split(",") if only else None)
+    for name, r in report["results"].items():
+        print(f"{name:24} median {_fmt(r['median']):>10}   min {_fmt(r['min']):>10}")
+    if option("--json"):
+        with open(option("--json"), "w") as f:
+            json.dump(report, f, indent=2)
+    if option("--baseline"):
+        with open(option("--baseline")) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, float(option("--tolerance", "0.25")))
+        for name, base, cur, ratio in regressions:
+            print(f"REGRESSION {name}: {_fmt(base)} -> {_fmt(cur)} ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import threading
+from mdx import CACHE_DIR
+from obdlink import CANError
+
+# Negative responses that say a DID can't be read as things stand, asking again won't change that
+NRC_REQUEST_OUT_OF_RANGE = 0x31
+NRC_SECURITY_ACCESS_DENIED = 0x33
+NRC_SERVICE_NOT_SUPPORTED_IN_SESSION = 0x7F
+LEARNED_NRCS = (NRC_REQUEST_OUT_OF_RANGE, NRC_SECURITY_ACCESS_DENIED, NRC_SERVICE_NOT_SUPPORTED_IN_SESSION)
+
+_CAPS_VERSION = 1
+
+def read_part_number(diag, ecu_addr) -> str | None:
+    # Software part number (F188), identifies the module revision the learned capabilities belong to
+    try:
+        raw = diag.read_data_by_identifier(ecu_addr, 0xF188)
+    except (ValueError, CANError):
+        return None
+    part = raw.decode("utf-8", errors="replace").rstrip("\x00").strip()
+    return part or None
+
+class CapabilityCache:
+    """
+    DIDs an ECU refused to read, per diagnostic session, stored as JSON under the fdiag cache
+    directory. Entries are keyed by ECU address and software part number, so a reflashed
+    module starts from scratch.
+    """
+
+    def __init__(self, ecu_addr: int, part_number: str, cache_dir=None):
+        self.ecu_addr = ecu_addr
+        self.part_number = part_number
+        safe = re.sub(r"[^A-Za-z0-9._-]", "_", part_number)
+        self.path = os.path.join(cache_dir or CACHE_DIR, "ecus", f"{ecu_addr:03X}_{safe}.json")
+        self.sessions = {}  # session_ref -> {DID: NRC}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == _CAPS_VERSION and data.get("part_number") == part_number:
+                self.sessions = {session: {int(did, 16): nrc for did, nrc in dids.items()}
+                                 for session, dids in data["sessions"].items()}
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def unsupported(self, session_ref: str) -> dict:
+        return dict(self.sessions.get(session_ref, {}))
+
+    def record(self, session_ref: str, errors: dict):
+        # errors is {DID: NRC} as collected by UDS.read_data_by_identifiers, other NRCs may be transient
+        learned = self.sessions.setdefault(session_ref, {})
+        for identifier, nrc in errors.items():
+            if nrc in LEARNED_NRCS:
+                learned[identifier] = nrc
+
+    def forget(self, session_ref: str | None = None):
+        if session_ref is None:
+            self.sessions.clear()
+        else:
+            self.sessions.pop(session_ref, None)
+
+    def save(self):
+        data = {
+            "version": _CAPS_VERSION,
+            "ecu": f"{self.ecu_addr:03X}",
+            "part_number": self.part_number,
+            "sessions": {session: {f"{did:04X}": nrc for did, nrc in sorted(dids.items())}
+                         for session, dids in self.sessions.items()},
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"  # Parallel scans may share a part number
+            with open(tmp, "w") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # Best-effort, same as the MDX cache
+
+def group_by_requirement(access_index, unsupported: dict, session_ref: str) -> dict:
+    # Sorts refused DIDs by what it would take to read them: {label: [DID, ...]}
+    groups = {}
+    sessions = sorted({key[0] for key in access_index if key[0] != session_ref})
+    for identifier, nrc in sorted(unsupported.items()):
+        if nrc == NRC_SECURITY_ACCESS_DENIED:
+            label = f"needs security access in {session_ref}"
+        else:
+            others = [s for s in sessions
+                      if identifier in access_index.get((s, "service_22", "READABLE"), ())]
+            label = f"needs {' or '.join(others)}" if others else "not supported by this software"
+        groups.setdefault(label, []).append(identifier)
+    return groups
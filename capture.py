@@ -0,0 +1,225 @@
+import json
+import mmap
+import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from decode import compile_decoders
+
+# On-disk layout, one directory per capture:
+#   index.json        DID sizes and field names
+#   <DID>.t           float64 timestamps (time.time()), one per sample
+#   <DID>.raw         the raw response bytes, BYTE_SIZE per sample
+#   <DID>.<n>.v       float64 decoded value of SUB_FIELD n, NaN where it isn't numeric
+# Every column is a flat array in native byte order, so row i is at a fixed offset in each file.
+# Sample counts come from the file sizes, the index is only rewritten when a DID is added.
+
+_CAPTURE_VERSION = 1
+
+class _Column:
+    __slots__ = ("identifier", "size", "decoder", "times", "raw", "values", "files")
+
+class CaptureWriter:
+    """
+    Capture sink for polled DID values. Samples are appended to in-memory arrays and written out
+    every `chunk` samples per DID, attach() hooks it into a UDS so every successful read lands here.
+
+        with CaptureWriter("soak-01", parsed) as cap:
+            cap.attach(diag)
+            while True:
+                diag.read_data_by_identifiers(0x716, [0xD111, 0xC01F, 0xC02A], sizes)
+    """
+
+    def __init__(self, path, parsed_data=None, decoders: dict | None = None, chunk: int = 4096):
+        self.path = path
+        self.chunk = chunk
+        if decoders is None and parsed_data is not None:
+            decoders = compile_decoders(parsed_data)
+        self.decoders = decoders or {}
+        self._columns = {}
+        self._index = {"version": _CAPTURE_VERSION, "dids": {}}
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, "index.json")
+        if os.path.exists(index_path):
+            # Appending to an existing capture
+            with open(index_path) as f:
+                self._index = json.load(f)
+        self._diag = None
+
+    def attach(self, diag):
+        diag.capture = self
+        self._diag = diag
+        return self
+
+    def detach(self):
+        if self._diag is not None and self._diag.capture is self:
+            self._diag.capture = None
+        self._diag = None
+
+    def _column(self, identifier: int, raw: bytes) -> _Column:
+        c = _Column()
+        c.identifier = identifier
+        key = f"{identifier:04X}"
+        c.decoder = self.decoders.get(identifier)
+        known = self._index["dids"].get(key)
+        if known is not None:
+            c.size = known["size"]
+        else:
+            c.size = c.decoder.size if c.decoder is not None and c.decoder.size else len(raw)
+            fields = [f.name for f in c.decoder.fields] if c.decoder is not None else []
+            self._index["dids"][key] = {"size": c.size, "fields": fields}
+            self._write_index()
+        nfields = len(self._index["dids"][key]["fields"])
+        if c.decoder is not None and len(c.decoder.fields) != nfields:
+            c.decoder = None  # Capture was started against a different MDX, keep raw only
+        c.times = array("d")
+        c.raw = bytearray()
+        c.values = [array("d") for _ in range(nfields)]
+        base = os.path.join(self.path, key)
+        c.files = [open(f"{base}.t", "ab"), open(f"{base}.raw", "ab")] + \
+                  [open(f"{base}.{n}.v", "ab") for n in range(nfields)]
+        self._columns[identifier] = c
+        return c
+
+    def _write_index(self):
+        tmp = os.path.join(self.path, f"index.json.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, "index.json"))
+
+    def append(self, identifier: int, raw: bytes, timestamp: float | None = None):
+        c = self._columns.get(identifier) or self._column(identifier, raw)
+        if len(raw) != c.size:
+            raw = raw[:c.size].ljust(c.size, b"\x00")
+        c.times.append(time.time() if timestamp is None else timestamp)
+        c.raw += raw
+        if c.decoder is not None:
+            c.decoder.append_numeric(raw, c.values)
+        elif c.values:
+            for column in c.values:
+                column.append(float("nan"))
+        if len(c.times) >= self.chunk:
+            self._flush(c)
+
+    def _flush(self, c: _Column):
+        if not c.times:
+            return
+        # Values and raw first, timestamps last: a reader sizes each DID by its shortest column
+        for column, f in zip(c.values, c.files[2:]):
+            column.tofile(f)
+        c.files[1].write(c.raw)
+        c.times.tofile(c.files[0])
+        for f in c.files:
+            f.flush()
+        c.times = array("d")
+        c.raw = bytearray()
+        c.values = [array("d") for _ in c.values]
+
+    def flush(self):
+        for c in self._columns.values():
+            self._flush(c)
+
+    def close(self):
+        self.detach()
+        self.flush()
+        for c in self._columns.values():
+            for f in c.files:
+                f.close()
+        self._columns.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+CaptureSlice = namedtuple("CaptureSlice", ["times", "raw", "values"])
+
+class CaptureReader:
+    """
+    Memory-maps a capture and hands out memoryview slices into it, nothing is copied or loaded
+    until it's touched. Timestamps are in append order, so time ranges are found by bisection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self._index = json.load(f)
+        self._maps = []
+        self._columns = {}
+
+    @property
+    def dids(self) -> list:
+        return [int(key, 16) for key in self._index["dids"]]
+
+    def fields(self, identifier: int) -> list:
+        return self._index["dids"][f"{identifier:04X}"]["fields"]
+
+    def _map(self, name: str) -> memoryview:
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(m)
+        return memoryview(m)
+
+    def _open(self, identifier: int):
+        if identifier in self._columns:
+            return self._columns[identifier]
+        key = f"{identifier:04X}"
+        info = self._index["dids"][key]
+        size = info["size"]
+        times = self._map(f"{key}.t")
+        raw = self._map(f"{key}.raw")
+        values = [self._map(f"{key}.{n}.v") for n in range(len(info["fields"]))]
+        count = min([len(times) // 8, len(raw) // size if size else len(times) // 8] + [len(v) // 8 for v in values])
+        column = (count, size, times[:count * 8].cast("d"), raw[:count * size],
+                  [v[:count * 8].cast("d") for v in values])
+        self._columns[identifier] = column
+        return column
+
+    def count(self, identifier: int) -> int:
+        return self._open(identifier)[0]
+
+    def slice(self, identifier: int, start: float | None = None, end: float | None = None) -> CaptureSlice:
+        # Samples with start <= time < end. raw is a flat memoryview, sample i is raw[i*size:(i+1)*size]
+        count, size, times, raw, values = self._open(identifier)
+        lo = 0 if start is None else bisect_left(times, start)
+        hi = count if end is None else bisect_left(times, end, lo)
+        names = self.fields(identifier)
+        return CaptureSlice(times[lo:hi], raw[lo * size:hi * size],
+                            {name: v[lo:hi] for name, v in zip(names, values)})
+
+    def samples(self, identifier: int, start: float | None = None, end: float | None = None):
+        # (time, raw bytes) pairs, for when a loop is simpler than column maths
+        s = self.slice(identifier, start, end)
+        size = self._open(identifier)[1]
+        for i, t in enumerate(s.times):
+            yield t, bytes(s.raw[i * size:(i + 1) * size])
+
+    def close(self):
+        self._columns.clear()
+        for m in self._maps:
+            try:
+                m.close()
+            except BufferError:
+                pass  # A slice handed out earlier is still alive, the map goes when it does
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <capture_dir>")
+        sys.exit(1)
+    with CaptureReader(sys.argv[1]) as reader:
+        for identifier in reader.dids:
+            s = reader.slice(identifier)
+            span = f"{s.times[-1] - s.times[0]:.1f}s" if len(s.times) else "-"
+            print(f"0x{identifier:04X}: {len(s.times)} samples over {span}, fields: {', '.join(reader.fields(identifier))}")
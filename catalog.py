@@ -0,0 +1,154 @@
+import os
+import sys
+from mdx import load_mdx, lookup_dtc, dtc_number
+
+_SCALARS = (str, int, float, bool, type(None))
+
+class _Interner:
+    """
+    Hash-consing for parsed MDX data: equal strings, dicts, lists, tuples and frozensets come out
+    as one shared object. Modules are mostly built from the same DIDs, enum tables, units and
+    descriptions, so each of those is stored once however many modules use it.
+    """
+
+    def __init__(self):
+        self._table = {}
+
+    def _key(self, value):
+        # Containers are already canonical by the time they're part of a key, so identity will do.
+        # Strings stand for themselves, other scalars carry their type so True and 1 stay apart.
+        if type(value) is str:
+            return value
+        return (type(value), value) if isinstance(value, _SCALARS) else id(value)
+
+    def share(self, value):
+        t = type(value)
+        if t is str:
+            return sys.intern(value)
+        if t is dict:
+            value = {self.share(k): self.share(v) for k, v in value.items()}
+            key = (dict,) + tuple(self._key(x) for item in value.items() for x in item)
+        elif t is list or t is tuple:
+            value = t(self.share(v) for v in value)
+            key = (t,) + tuple(self._key(v) for v in value)
+        elif t is frozenset:
+            value = frozenset(self.share(v) for v in value)
+            key = (frozenset, frozenset(self._key(v) for v in value))
+        else:
+            return value
+        return self._table.setdefault(key, value)
+
+class Module:
+    """One ECU's MDX in a catalog. `data` is shared with other modules, treat it as read-only."""
+    __slots__ = ("name", "shortname", "path", "physical_address", "response_address", "functional_address", "data")
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.name = data["ecu"]["name"]
+        self.shortname = data["ecu"]["shortname"]
+        addresses = data["protocol"]["addresses"]
+        self.physical_address = addresses.get("physical")
+        self.response_address = addresses.get("response")
+        self.functional_address = addresses.get("functional")
+
+    def __repr__(self):
+        address = f"0x{self.physical_address:03X}" if self.physical_address is not None else "?"
+        return f"<Module {self.shortname or self.name} {address} {os.path.basename(self.path)}>"
+
+class MDXCatalog:
+    """
+    Every module of a vehicle, one MDX each, with lookups across all of them:
+
+        catalog = MDXCatalog()
+        catalog.load_directory("mdx/")
+        catalog.module(0x716)                 # by physical or response CAN ID
+        catalog.modules_for_did(0xF188)       # every module that has the DID
+        catalog.interpret_dtc("C02809")       # [(module, DTC entry), ...]
+
+    Loaded data goes through one interner, so memory grows with what's unique to each module
+    rather than with the number of modules. If two files claim the same address (e.g. two
+    software levels), the one loaded last answers address lookups.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.modules = []
+        self._paths = {}
+        self._interner = _Interner()
+        self._by_address = {}
+        self._dids = {}   # DID -> tuple of modules
+        self._dtcs = {}   # 3-byte DTC number -> tuple of modules
+        self._owners = {}  # Shared owner tuples, most DIDs have the same few owners
+
+    def __len__(self):
+        return len(self.modules)
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def load(self, path) -> Module:
+        key = os.path.abspath(path)
+        if key in self._paths:
+            return self._paths[key]
+        module = Module(path, self._interner.share(load_mdx(path, self.cache_dir)))
+        self.modules.append(module)
+        self._paths[key] = module
+        for address in (module.physical_address, module.response_address):
+            if address is not None:
+                self._by_address[address] = module
+        for number in module.data["dids"]:
+            if number:
+                self._own(self._dids, int(number, 16), module)
+        for number in module.data["dtc_index"]:
+            self._own(self._dtcs, number, module)
+        return module
+
+    def load_directory(self, directory) -> list:
+        names = sorted(n for n in os.listdir(directory) if n.lower().endswith(".mdx"))
+        return [self.load(os.path.join(directory, n)) for n in names]
+
+    def _own(self, index: dict, number: int, module: Module):
+        owners = index.get(number, ()) + (module,)
+        index[number] = self._owners.setdefault(owners, owners)
+
+    def module(self, address: int) -> Module | None:
+        # Module reached on (or answering from) a CAN ID, e.g. 0x716 or 0x71E
+        return self._by_address.get(address)
+
+    def modules_for_did(self, identifier: int) -> tuple:
+        return self._dids.get(identifier, ())
+
+    def modules_for_dtc(self, code) -> tuple:
+        number = dtc_number(code)
+        return self._dtcs.get(number, ()) if number is not None else ()
+
+    def did(self, identifier: int) -> list:
+        # [(module, DID entry)] for every module that has it
+        return [(m, m.data["dids"][f"0x{identifier:04X}"]) for m in self.modules_for_did(identifier)]
+
+    def interpret_dtc(self, code) -> list:
+        # mdx.interpret_dtc across every module: [(module, DTC entry)]
+        number = dtc_number(code)
+        if number is None:
+            return []
+        return [(m, lookup_dtc(m.data, number)) for m in self._dtcs.get(number, ())]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <mdx_dir> [--address 0x716] [--did 0xF188] [--dtc C02809]")
+        sys.exit(1)
+    catalog = MDXCatalog()
+    catalog.load_directory(sys.argv[1])
+    args = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+    if "--address" in args:
+        print(catalog.module(int(args["--address"], 0)))
+    if "--did" in args:
+        for module, info in catalog.did(int(args["--did"], 16)):
+            print(f"{module}: {info['name']}")
+    if "--dtc" in args:
+        for module, info in catalog.interpret_dtc(args["--dtc"]):
+            print(f"{module}: {info['base_description']} - {info['failure_description']}")
+    if len(args) == 0:
+        for module in catalog:
+            print(f"{module}: {len(module.data['dids'])} DIDs, {len(module.data['dtc_index'])} DTCs")
@@ -0,0 +1,177 @@
+from collections import namedtuple
+
+DecodedField = namedtuple("DecodedField", ["name", "value", "units"])
+
+# Field kinds, resolved once per SUB_FIELD when the decoder is compiled
+_UNSIGNED, _SIGNED, _ENUM, _BYTES, _ASCII, _BCD, _DTC = range(7)
+_INT_KINDS = (_UNSIGNED, _SIGNED, _ENUM)
+_NAN = float("nan")
+
+class _Field:
+    __slots__ = ("name", "kind", "shift", "mask", "sign", "start", "end",
+                 "scale", "offset", "table", "units", "fill", "right")
+
+def _compile_field(sf, size):
+    f = _Field()
+    f.name = sf["name"]
+    f.units = sf.get("units", "")
+    lsb, msb = int(sf["lsb"]), int(sf["msb"])
+    width = msb - lsb + 1
+    # Bit 0 is the least significant bit of the last byte, MDX numbers bits across the whole DID
+    f.start = size - 1 - msb // 8
+    f.end = size - lsb // 8
+    f.shift = lsb
+    f.mask = (1 << width) - 1
+    f.sign = 1 << (width - 1)
+    aligned = lsb % 8 == 0 and width % 8 == 0
+    data_type = sf.get("data_type", "")
+    if data_type == "ascii" and aligned:
+        f.kind = _ASCII
+    elif data_type == "bcd" and aligned:
+        f.kind = _BCD
+    elif data_type == "DTC" and aligned:
+        f.kind = _DTC
+    elif data_type == "bytes" and aligned:
+        f.kind = _BYTES
+    elif data_type == "enumerated" and sf.get("enum"):
+        f.kind = _ENUM
+    elif data_type == "signed":
+        f.kind = _SIGNED
+    else:
+        f.kind = _UNSIGNED  # Also covers bit-packed "bytes" fields
+    f.table = sf.get("enum") or {}
+    f.offset = sf.get("offset") or 0
+    res = sf.get("resolution")
+    f.scale = None if res is None or res[0] == res[1] else res[0] / res[1]
+    f.fill = None if sf.get("fill") is None else bytes([sf["fill"]])
+    f.right = sf.get("justification") == "right"
+    return f
+
+class DIDDecoder:
+    def __init__(self, info):
+        self.number = int(info["number"], 16)
+        self.name = info["name"]
+        self.size = int(info["byte_size"] or 0)
+        self.fields = [_compile_field(sf, self.size) for sf in info["subfields"]]
+        self._needs_int = any(f.kind in _INT_KINDS for f in self.fields)
+
+    def decode(self, raw: bytes) -> list:
+        size = self.size
+        have = len(raw)
+        if self._needs_int:
+            value = int.from_bytes(raw[:size].ljust(size, b"\x00"), "big")
+        out = []
+        for f in self.fields:
+            if f.end > have:
+                # ECU returned less than the MDX describes
+                out.append(DecodedField(f.name, None, f.units))
+                continue
+            kind = f.kind
+            if kind in _INT_KINDS:
+                v = (value >> f.shift) & f.mask
+                if kind == _ENUM:
+                    v = f.table.get(v, v)
+                else:
+                    if kind == _SIGNED and v & f.sign:
+                        v -= f.sign << 1
+                    if f.scale is not None:
+                        v = v * f.scale
+                    if f.offset:
+                        v = v + f.offset
+            elif kind == _ASCII:
+                b = raw[f.start:f.end]
+                if f.fill is not None:
+                    b = b.lstrip(f.fill) if f.right else b.rstrip(f.fill)
+                v = b.rstrip(b"\x00").decode("ascii", errors="replace")
+            elif kind == _BCD:
+                v = raw[f.start:f.end].hex()
+                v = int(v) if v.isdigit() else v.upper()
+            elif kind == _DTC:
+                v = raw[f.start:f.end].hex().upper()
+            else:
+                v = raw[f.start:f.end]
+            out.append(DecodedField(f.name, v, f.units))
+        return out
+
+    def append_numeric(self, raw: bytes, columns: list):
+        # Appends each field's numeric value (NaN for text/bytes) to the matching column in
+        # `columns`, e.g. array('d')s, without building DecodedFields. Enums give the raw value.
+        size = self.size
+        have = len(raw)
+        value = int.from_bytes(raw[:size].ljust(size, b"\x00"), "big") if self._needs_int else 0
+        for f, column in zip(self.fields, columns):
+            if f.end > have or f.kind not in _INT_KINDS:
+                column.append(_NAN)
+                continue
+            v = (value >> f.shift) & f.mask
+            if f.kind != _ENUM:
+                if f.kind == _SIGNED and v & f.sign:
+                    v -= f.sign << 1
+                if f.scale is not None:
+                    v = v * f.scale
+                if f.offset:
+                    v = v + f.offset
+            column.append(v)
+
+    def decode_dict(self, raw: bytes) -> dict:
+        return {f.name: f.value for f in self.decode(raw)}
+
+def compile_decoders(parsed_data) -> dict:
+    # Keyed by integer DID so lookups from UDS responses don't need string formatting
+    decoders = {}
+    for num, info in parsed_data["dids"].items():
+        if num:
+            decoders[int(num, 16)] = DIDDecoder(info)
+    return decoders
+
+Snapshot = namedtuple("Snapshot", ["record", "values"])  # values is {DID: [DecodedField, ...]}
+
+class DTCDataDecoder:
+    """Splits 19 04 snapshot and 19 06 extended data payloads with layouts compiled from the MDX."""
+
+    def __init__(self, parsed_data, decoders: dict | None = None):
+        self.dids = decoders if decoders is not None else compile_decoders(parsed_data)
+        self.extended = {number: DIDDecoder(info) for number, info in parsed_data["extended_records"].items()}
+
+    def snapshots(self, payload: bytes) -> list:
+        out = []
+        i = 0
+        while i + 2 <= len(payload):
+            record, count = payload[i], payload[i+1]
+            i += 2
+            values = {}
+            for _ in range(count):
+                identifier = int.from_bytes(payload[i:i+2], "big")
+                decoder = self.dids.get(identifier)
+                if decoder is None:
+                    # Size unknown, nothing after this can be split out
+                    values[identifier] = payload[i+2:]
+                    out.append(Snapshot(record, values))
+                    return out
+                values[identifier] = decoder.decode(payload[i+2:i+2+decoder.size])
+                i += 2 + decoder.size
+            out.append(Snapshot(record, values))
+        return out
+
+    def extended_data(self, payload: bytes) -> dict:
+        # {record number: [DecodedField, ...]}, an unknown record swallows the rest as bytes
+        out = {}
+        i = 0
+        while i < len(payload):
+            record = payload[i]
+            decoder = self.extended.get(record)
+            if decoder is None:
+                out[record] = payload[i+1:]
+                break
+            out[record] = decoder.decode(payload[i+1:i+1+decoder.size])
+            i += 1 + decoder.size
+        return out
+
+def format_fields(fields) -> str:
+    parts = []
+    for f in fields:
+        v = f.value.hex().upper() if isinstance(f.value, bytes) else f.value
+        if isinstance(v, float):
+            v = f"{v:g}"
+        parts.append(f"{f.name}: {v} {f.units}".rstrip() if f.units else f"{f.name}: {v}")
+    return ", ".join(parts)
@@ -0,0 +1,116 @@
+import time
+from collections import namedtuple
+from decode import DTCDataDecoder
+
+# DTC status byte (ISO 14229-1 D.2), bit 0 first
+STATUS_BITS = (
+    "testFailed",
+    "testFailedThisOperationCycle",
+    "pendingDTC",
+    "confirmedDTC",
+    "testNotCompletedSinceLastClear",
+    "testFailedSinceLastClear",
+    "testNotCompletedThisOperationCycle",
+    "warningIndicatorRequested",
+)
+
+class DTCRecord(namedtuple("DTCRecord", ["dtc", "ftb", "status"])):
+    """One DTC from a 0x19 report: 2-byte base code, failure type byte and status byte."""
+    __slots__ = ()
+
+    @property
+    def number(self) -> int:
+        return self.dtc << 8 | self.ftb
+
+    @property
+    def code(self) -> str:
+        # Same form as UDS.read_dtcs and mdx.interpret_dtc use, e.g. "C02809"
+        return f"{self.number:06X}"
+
+    @property
+    def status_bits(self) -> tuple:
+        return tuple(name for bit, name in enumerate(STATUS_BITS) if self.status >> bit & 1)
+
+DTCChange = namedtuple("DTCChange", ["kind", "record", "previous_status"])
+
+# DTCChange.kind
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+def parse_dtc_records(payload: bytes) -> list:
+    # (DTC high, DTC low, FTB, status) quadruples following 59 02 <availability mask>
+    return [DTCRecord(payload[i] << 8 | payload[i+1], payload[i+2], payload[i+3])
+            for i in range(0, len(payload) - 3, 4)]
+
+class DTCWatcher:
+    """
+    Polls an ECU's DTCs and reports only what changed since the last poll.
+
+    Each poll first asks for the number of matching DTCs (19 01), which is a short single-frame
+    exchange. The full report (19 02) is only fetched when that count moves, or every
+    `full_every` polls regardless, since a status change (or one DTC replacing another) leaves
+    the count as it was.
+    """
+
+    def __init__(self, diag, target: bytes | int, status_mask: int = 0xFF, full_every: int = 10):
+        self.diag = diag
+        self.target = target
+        self.status_mask = status_mask
+        self.full_every = full_every
+        self.current = None  # DTC number -> DTCRecord, None until the first full report
+        self._count = None
+        self._since_full = 0
+
+    def poll(self) -> list:
+        count = self.diag.count_dtcs(self.target, self.status_mask)
+        self._since_full += 1
+        if self.current is not None and count == self._count and self._since_full < self.full_every:
+            return []
+        self._count = count
+        self._since_full = 0
+        records = {r.number: r for r in self.diag.read_dtc_records(self.target, self.status_mask)}
+        previous, self.current = self.current or {}, records
+        changes = []
+        for number, record in records.items():
+            old = previous.get(number)
+            if old is None:
+                changes.append(DTCChange(ADDED, record, None))
+            elif old.status != record.status:
+                changes.append(DTCChange(CHANGED, record, old.status))
+        for number, old in previous.items():
+            if number not in records:
+                changes.append(DTCChange(REMOVED, old, old.status))
+        return changes
+
+    def watch(self, interval: float = 1.0):
+        # Generator of DTCChanges, polling every `interval` seconds
+        while True:
+            start = time.monotonic()
+            yield from self.poll()
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+DTCDetails = namedtuple("DTCDetails", ["record", "info", "snapshots", "extended"])
+
+def read_dtc_details(diag, target: bytes | int, parsed_data, status_mask: int = 0xFF,
+                     decoder: DTCDataDecoder | None = None) -> list:
+    # Every matching DTC with its MDX entry, decoded snapshots and extended data in one pass.
+    # Snapshots/extended data are only requested when the MDX says the DTC has them.
+    from obdlink import CANError  # obdlink imports this module
+    decoder = decoder or DTCDataDecoder(parsed_data)
+    details = []
+    for record in diag.read_dtc_records(target, status_mask):
+        info = parsed_data["dtc_index"].get(record.number)
+        snapshots, extended = [], {}
+        if info is None or info["snapshots"]:
+            try:
+                snapshots = decoder.snapshots(diag.read_dtc_snapshot(target, record.number))
+            except (ValueError, CANError):
+                pass
+        if info is None or info["extended_records"]:
+            try:
+                extended = decoder.extended_data(diag.read_dtc_extended_data(target, record.number))
+            except (ValueError, CANError):
+                pass
+        details.append(DTCDetails(record, info, snapshots, extended))
+    return details
@@ -0,0 +1,94 @@
+from decode import DIDDecoder
+from obdlink import CANError
+
+# First DID of the range ISO 14229 sets aside for dynamically defined identifiers
+DYNAMIC_DID_BASE = 0xF300
+
+class CompositeDID:
+    """
+    A set of signals packed into one dynamically defined DID (0x2C), so a polling cycle is a
+    single 0x22 request instead of one per source DID.
+
+    Signals are DIDs (all of their SUB_FIELDs) or (DID, SUB_FIELD name) pairs. Only the bytes
+    covering the selected SUB_FIELDs' bit positions are copied into the composite, adjacent or
+    overlapping ranges from the same DID are merged into one source.
+
+        hot = CompositeDID(parsed, [0xD111, (0xC01F, "Trip Counter Value")])
+        values = hot.read(diag, 0x716)  # {0xD111: [DecodedField, ...], 0xC01F: [...]}
+    """
+
+    def __init__(self, parsed_data, signals: list, dynamic_id: int = DYNAMIC_DID_BASE):
+        self.dynamic_id = dynamic_id
+        wanted = {}  # DID -> SUB_FIELD names, None for all of them
+        for signal in signals:
+            identifier, name = signal if isinstance(signal, tuple) else (signal, None)
+            if name is None:
+                wanted[identifier] = None
+            elif wanted.get(identifier, ()) is not None:
+                wanted.setdefault(identifier, []).append(name)
+
+        self.sources = []   # (DID, 1-based byte position, size) as sent in 0x2C
+        self._layout = []   # (DID, offset in the composite, offset in the source DID, size)
+        self._decoders = {}
+        self._sizes = {}
+        offset = 0
+        for identifier, names in wanted.items():
+            info = parsed_data["dids"].get(f"0x{identifier:04X}")
+            if info is None:
+                raise KeyError(f"DID 0x{identifier:04X} not in MDX")
+            if names is not None:
+                missing = set(names) - {sf["name"] for sf in info["subfields"]}
+                if missing:
+                    raise KeyError(f"DID 0x{identifier:04X} has no SUB_FIELD {', '.join(sorted(missing))}")
+                info = dict(info, subfields=[sf for sf in info["subfields"] if sf["name"] in names])
+            decoder = DIDDecoder(info)
+            ranges = sorted((f.start, f.end) for f in decoder.fields) or [(0, decoder.size)]
+            for start, end in _merge(ranges):
+                # memorySize is one byte
+                for chunk in range(start, end, 0xFF):
+                    size = min(end, chunk + 0xFF) - chunk
+                    self.sources.append((identifier, chunk + 1, size))
+                    self._layout.append((identifier, offset, chunk, size))
+                    offset += size
+            self._decoders[identifier] = decoder
+            self._sizes[identifier] = decoder.size
+        self.size = offset
+
+    def split(self, raw: bytes) -> dict:
+        # Composite data -> {DID: bytes at the source DID's full size}, bytes that weren't copied are zero
+        out = {identifier: bytearray(size) for identifier, size in self._sizes.items()}
+        for identifier, offset, start, size in self._layout:
+            out[identifier][start:start + size] = raw[offset:offset + size]
+        return {identifier: bytes(data) for identifier, data in out.items()}
+
+    def decode(self, raw: bytes) -> dict:
+        if len(raw) < self.size:
+            raise ValueError(f"Composite DID 0x{self.dynamic_id:04X} returned {len(raw)} bytes, expected {self.size}")
+        return {identifier: self._decoders[identifier].decode(data) for identifier, data in self.split(raw).items()}
+
+    def define(self, diag, target: bytes | int, force: bool = False):
+        if 3 + self.size > diag.adapter.max_response:
+            raise ValueError(f"Composite DID is {self.size} bytes, too long for the adapter")
+        diag.define_dynamic_identifier(target, self.dynamic_id, self.sources, force)
+
+    def read(self, diag, target: bytes | int) -> dict:
+        self.define(diag, target)
+        try:
+            raw = diag.read_data_by_identifier(target, self.dynamic_id)
+        except (ValueError, CANError):
+            # Definitions don't survive a session change or ECU reset, define it again once
+            self.define(diag, target, force=True)
+            raw = diag.read_data_by_identifier(target, self.dynamic_id)
+        return self.decode(raw)
+
+    def clear(self, diag, target: bytes | int):
+        diag.clear_dynamic_identifier(target, self.dynamic_id)
+
+def _merge(ranges: list) -> list:
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
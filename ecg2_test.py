@@ -1,4 +1,5 @@
 from obdlink import *
+from timing import LatencyStats
 import time
 
 def bcd_decode(data: bytes, decimals: int):
@@ -16,6 +17,8 @@ def test(port):
 
     elm = OBDLink(port)
     diag = UDS(elm)
+    stats = LatencyStats()
+    elm.hooks.append(stats)
     elm.connect()
     elm.defaults()
     
@@ -109,15 +112,19 @@ def test(port):
     else:
         print("No stored DTCs")
 
+    print(f"\n ==== Command Timing ====")
+    print(stats.report())
+    elm.hooks.remove(stats)
 
     # Keep awake indefinitely
     print("\nKeeping the connection alive. Press Ctrl+C to exit.")
+    diag.start_keepalive(0x716)
     try:
         while True:
-            diag.tester_present(0x716)
             time.sleep(1)
     except KeyboardInterrupt:
         print("Exiting...")
+    diag.stop_keepalive()
 
     elm.disconnect()
 
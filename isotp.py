@@ -0,0 +1,144 @@
+import math
+from collections import namedtuple
+
+# ISO 15765-2 protocol control information, high nibble of the first byte
+SINGLE_FRAME = 0x0
+FIRST_FRAME = 0x1
+CONSECUTIVE_FRAME = 0x2
+FLOW_CONTROL = 0x3
+
+# Flow control status
+CONTINUE_TO_SEND = 0x0
+WAIT = 0x1
+OVERFLOW = 0x2
+
+class ISOTPError(Exception):
+    """Raised on a malformed, out of order or overflowed ISO-TP exchange."""
+    pass
+
+# bs: frames per block (0 = no limit), st_min: seconds between consecutive frames,
+# n_bs/n_cr: seconds to wait for a flow control / the next consecutive frame,
+# max_msg_size: largest message either side may send
+NetworkParameters = namedtuple("NetworkParameters", ["bs", "st_min", "n_bs", "n_cr", "max_msg_size"])
+
+# ISO 15765-2 defaults for an ECU whose MDX doesn't say
+DEFAULT_PARAMETERS = NetworkParameters(0, 0.0, 1.0, 1.0, 4095)
+
+def network_parameters(network: dict | None) -> NetworkParameters:
+    # From mdx "protocol"/"network" (milliseconds), anything missing stays at the default
+    network = network or {}
+    d = DEFAULT_PARAMETERS
+
+    def seconds(key, default):
+        return network[key] / 1000 if network.get(key) is not None else default
+
+    return NetworkParameters(network.get("bs", d.bs), seconds("st_min", d.st_min), seconds("n_bs_timeout", d.n_bs),
+                             seconds("n_cr_timeout", d.n_cr), network.get("max_msg_size") or d.max_msg_size)
+
+def st_min_seconds(value: int) -> float:
+    # 0x00-0x7F milliseconds, 0xF1-0xF9 100-900 microseconds, reserved values mean the maximum
+    if value <= 0x7F:
+        return value / 1000
+    if 0xF1 <= value <= 0xF9:
+        return (value - 0xF0) / 10000
+    return 0.127
+
+def st_min_byte(seconds: float) -> int:
+    # Smallest STmin encoding that is at least `seconds`
+    if seconds <= 0:
+        return 0x00
+    if seconds <= 0.0009:
+        return 0xF0 + max(1, math.ceil(seconds * 10000))
+    return min(0x7F, math.ceil(seconds * 1000))
+
+def pad(frame: bytes, filler: int = 0xAA) -> bytes:
+    return frame.ljust(8, bytes([filler]))
+
+def segment(data: bytes) -> list:
+    # Frames carrying `data`: a single frame, or a first frame and its consecutive frames (unpadded)
+    if len(data) <= 7:
+        return [bytes([len(data)]) + data]
+    if len(data) > 0xFFF:
+        raise ISOTPError(f"{len(data)} byte message is too long for ISO-TP")
+    frames = [bytes([FIRST_FRAME << 4 | len(data) >> 8, len(data) & 0xFF]) + data[:6]]
+    for n, i in enumerate(range(6, len(data), 7), start=1):
+        frames.append(bytes([CONSECUTIVE_FRAME << 4 | n % 16]) + data[i:i+7])
+    return frames
+
+def flow_control(status: int = CONTINUE_TO_SEND, bs: int = 0, st_min: float = 0.0) -> bytes:
+    return bytes([FLOW_CONTROL << 4 | status, bs, st_min_byte(st_min)])
+
+FlowControl = namedtuple("FlowControl", ["status", "bs", "st_min"])
+
+def parse_flow_control(frame: bytes) -> FlowControl:
+    if len(frame) < 3 or frame[0] >> 4 != FLOW_CONTROL:
+        raise ISOTPError(f"Expected a flow control frame, got {frame.hex()}")
+    if frame[0] & 0x0F > OVERFLOW:
+        raise ISOTPError(f"Invalid flow status in {frame.hex()}")
+    return FlowControl(frame[0] & 0x0F, frame[1], st_min_seconds(frame[2]))
+
+class Reassembler:
+    """
+    Receive side: feed() it frames in order, it returns the message once the last one is in.
+    Frames are the CAN data bytes, padding included.
+    """
+
+    def __init__(self, max_msg_size: int = 4095):
+        self.max_msg_size = max_msg_size
+        self.length = None
+        self.data = bytearray()
+        self._next = 1
+
+    @property
+    def remaining(self) -> int:
+        # Consecutive frames still to come
+        return 0 if self.length is None else -(-(self.length - len(self.data)) // 7)
+
+    def feed(self, frame: bytes) -> bytes | None:
+        if not frame:
+            raise ISOTPError("Empty frame")
+        kind = frame[0] >> 4
+        if kind == SINGLE_FRAME:
+            length = frame[0] & 0x0F
+            if not 0 < length <= len(frame) - 1:
+                raise ISOTPError(f"Bad single frame {frame.hex()}")
+            self.length = None
+            return bytes(frame[1:1 + length])
+        if kind == FIRST_FRAME:
+            if len(frame) < 8:
+                raise ISOTPError(f"Short first frame {frame.hex()}")
+            self.length = (frame[0] & 0x0F) << 8 | frame[1]
+            if self.length > self.max_msg_size:
+                raise ISOTPError(f"{self.length} byte message exceeds MAX_MSG_SIZE {self.max_msg_size}")
+            self.data = bytearray(frame[2:8])
+            self._next = 1
+            return None
+        if kind == CONSECUTIVE_FRAME:
+            if self.length is None:
+                raise ISOTPError("Consecutive frame without a first frame")
+            if frame[0] & 0x0F != self._next:
+                raise ISOTPError(f"Consecutive frame {frame[0] & 0x0F} out of sequence, expected {self._next}")
+            self._next = (self._next + 1) % 16
+            self.data += frame[1:1 + min(7, self.length - len(self.data))]
+            if len(self.data) < self.length:
+                return None
+            self.length = None
+            return bytes(self.data)
+        raise ISOTPError(f"Unexpected frame {frame.hex()}")
+
+def parse_segmented(lines: list) -> bytes:
+    # An ELM327's own rendering of a multi-frame response with CAN auto formatting on:
+    # the length in hex, then "<sequence>:<data>" for the first frame's data and each consecutive frame
+    try:
+        length = int(lines[0], 16)
+    except ValueError:
+        raise ISOTPError(f"Bad segmented response length {lines[0]!r}")
+    data = bytearray()
+    for n, line in enumerate(lines[1:]):
+        index, _, payload = line.partition(":")
+        if not payload or int(index, 16) != n % 16:
+            raise ISOTPError(f"Segmented response line {line!r} out of sequence")
+        data += bytes.fromhex(payload)
+    if len(data) < length:
+        raise ISOTPError(f"Segmented response has {len(data)} of {length} bytes")
+    return bytes(data[:length])
@@ -1,106 +1,407 @@
 import xml.etree.ElementTree as ET
+import hashlib
+import os
+import pickle
 
-def parse_mdx(file_path):
+def _number(text):
+    text = (text or "").strip()
+    if text.lower().startswith(("0x", "-0x")):
+        return int(text, 16)
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def _parse_subfield(sf):
+    dd = sf.find("DATA_DEFINITION")
+    field = {
+        "name": (sf.findtext("NAME") or "").strip(),
+        "lsb": (sf.findtext("LEAST_SIG_BIT") or "").strip(),
+        "msb": (sf.findtext("MOST_SIG_BIT") or "").strip(),
+        "data_type": "", "units": "", "resolution": None, "offset": 0,
+        "enum": None, "fill": None, "justification": None
+    }
+    if dd is None:
+        return field
+    field["data_type"] = (dd.findtext("DATA_TYPE") or "").strip()
+    num = dd.find("NUMERIC_PARAMETERS")
+    if num is not None:
+        res = num.find("RESOLUTION")
+        if res is not None:
+            field["resolution"] = (_number(res.get("numerator", "1")), _number(res.get("denominator", "1")))
+        field["offset"] = _number(num.findtext("OFFSET") or "0")
+        field["units"] = (num.findtext("UNITS") or "").strip()
+    enum = dd.find("ENUMERATED_PARAMETERS")
+    if enum is not None:
+        field["enum"] = {
+            _number(m.findtext("ENUM_VALUE")): (m.findtext("DESCRIPTION") or "").strip()
+            for m in enum.findall("ENUM_MEMBER")
+        }
+    for params, fill in (("ASCII_PARAMETERS", "ASCII_FILL_VALUE"), ("BCD_PARAMETERS", "BCD_FILL_VALUE")):
+        p = dd.find(params)
+        if p is not None:
+            field["justification"] = (p.findtext("JUSTIFICATION") or "").strip() or None
+            if p.findtext(fill):
+                field["fill"] = _number(p.findtext(fill))
+    return field
+
+def _parse_did(did):
+    number = (did.findtext("NUMBER") or "").strip()
+    name = (did.findtext("NAME") or "").strip()
+    desc = (did.findtext("DESCRIPTION") or "").strip()
+    byte_size = (did.findtext("BYTE_SIZE") or "").strip()
+    did_type = (did.findtext("DID_TYPE") or "").strip()
+    access = {}
+    ap = did.find("ACCESS_PARAMETERS")
+    if ap is not None:
+        for child in ap:
+            access[child.tag] = child.attrib.copy()
+    subfields = [_parse_subfield(sf) for sf in did.findall("SUB_FIELD")]
+    return number, {
+        "number": number, "name": name, "description": desc,
+        "byte_size": byte_size, "did_type": did_type, "access": access,
+        "subfields": subfields
+    }
+
+def _parse_memory_area(area):
+    access = {}
+    ap = area.find("ACCESS_PARAMETERS")
+    if ap is not None:
+        for child in ap:
+            access[child.tag] = child.attrib.copy()
+    return {
+        "name": (area.findtext("NAME") or "").strip(),
+        "start": _number(area.findtext("START_ADDRESS")),
+        "size": _number(area.findtext("BYTE_SIZE")),
+        "access": access,
+    }
+
+def _parse_dtc(dtc, out):
+    base_num = dtc.findtext("NUMBER", "").replace("0x", "").upper().zfill(4)
+    base_desc = dtc.findtext("DESCRIPTION", "").strip()
+
+    for fi in dtc.findall("DTC_FAILURE_INFO"):
+        fi_desc = fi.findtext("DESCRIPTION", "").strip()
+        if fi_desc == "":
+            # fall back to DTC_CONTINUOUS_PARAMETERS / FDC_PASS_FAIL_CRITERIA
+            fi_desc = fi.findtext("DTC_CONTINUOUS_PARAMETERS/FDC_PASS_FAIL_CRITERIA", "").strip().replace("\n\n", "  ")
+        ftb_elem = fi.find("DTC_FTB")
+        if ftb_elem is not None and "FAILURE_REF" in ftb_elem.attrib:
+            ftb = ftb_elem.attrib["FAILURE_REF"].replace("ftb_", "").upper().zfill(2)
+            full_code = f"{base_num}{ftb}"
+        else:
+            full_code = base_num
+
+        # Record references, resolved to numbers by _link_dtc_records once everything is parsed
+        snapshots = {}
+        for srd in fi.iter("SNAPSHOT_RECORD_DATA"):
+            dids = srd.find("DIDS_SUPPORTED_BY_SNAPSHOT")
+            snapshots[srd.get("SNAPSHOT_REF")] = dids.get("DID_REFS", "").split() if dids is not None else []
+        edrs = [ref for edp in fi.iter("EXTENDED_DATA_PARAMETERS") for ref in edp.get("EDR_REFS", "").split()]
+
+        out[full_code] = {
+            "base_code": base_num,
+            "ftb": full_code[len(base_num):] if len(full_code) > len(base_num) else None,
+            "base_description": base_desc,
+            "failure_description": fi_desc,
+            "snapshots": snapshots,
+            "extended_records": list(dict.fromkeys(edrs))
+        }
+
+def _parse_snapshot_record(rec):
+    return _number(rec.findtext("NUMBER")), {
+        "number": (rec.findtext("NUMBER") or "").strip(),
+        "description": (rec.findtext("DESCRIPTION") or "").strip()
+    }
+
+def _parse_extended_record(rec):
+    # Laid out like a DID so decode.DIDDecoder can compile it
+    number = (rec.findtext("NUMBER") or "").strip()
+    name = (rec.findtext("NAME") or "").strip()
+    subfields = [_parse_subfield(sf) for sf in rec.findall("SUB_FIELD")]
+    for sf in subfields:
+        sf["name"] = sf["name"] or name  # Single-field records leave the SUB_FIELD unnamed
+    return _number(number), {
+        "number": number, "name": name,
+        "description": (rec.findtext("DESCRIPTION") or "").strip(),
+        "byte_size": (rec.findtext("BYTE_SIZE") or "").strip(), "did_type": "", "access": {},
+        "subfields": subfields
+    }
+
+def _link_dtc_records(data, refs):
+    # Swap MDX IDs (snapshot_10, did_DD00, edr_02) for numbers and build the integer DTC index
+    index = {}
+    for code, dtc in data["dtcs"].items():
+        dtc["snapshots"] = {refs[s]: [refs[d] for d in dids if d in refs]
+                            for s, dids in dtc["snapshots"].items() if s in refs}
+        dtc["extended_records"] = [refs[e] for e in dtc["extended_records"] if e in refs]
+        # 3-byte DTC number, base-only codes take FTB 00
+        number = int(code, 16) << (8 if len(code) <= 4 else 0)
+        index.setdefault(number, dtc)
+    data["dtc_index"] = index
+
+# ISO-TP parameters from NETWORK_LAYER: ECU's block size and STmin (ms) for frames it receives,
+# N_Bs/N_Cr timeouts (ms), the largest message either side may send and the bus delay allowance
+_NETWORK_PARAMETERS = {"BS": "bs", "ST_MIN": "st_min", "N_BS_TIMEOUT": "n_bs_timeout",
+                       "N_CR_TIMEOUT": "n_cr_timeout", "MAX_MSG_SIZE": "max_msg_size", "DELTA_P2": "delta_p2"}
+
+# APPLICATION_LAYER_TIMING_PARAMETERS (ms): how long the ECU may take to answer, and to answer
+# after a response pending (0x78). A tester has to allow for the slowest session.
+_TIMING_PARAMETERS = {"P2_MAX": "p2_max", "P2_STAR_MAX": "p2_star_max"}
+
+def _session_values(section, tag):
+    return [(e.get("SESSION_REFS", "").split(), _number(e.text)) for e in section.findall(tag)
+            if (e.text or "").strip()]
+
+def _parse_protocol(proto):
+    info = {"max_dids_per_request": None, "network": {}, "timing": {}, "memory": {}, "addresses": {}}
+    if proto is None:
+        return info
+    # CAN IDs the ECU is reached on and answers from
+    link = proto.find("PHYSICAL_AND_LINK_LAYER")
+    if link is not None:
+        for tag, key in (("PHYSICAL_ADDRESS", "physical"), ("FUNCTIONAL_ADDRESS", "functional"), ("RESPONSE_ADDRESS", "response")):
+            if (link.findtext(tag) or "").strip():
+                info["addresses"][key] = _number(link.findtext(tag))
+    # addressAndLengthFormatIdentifier sizes, given with the download services (0x34/0x35)
+    for tag, key in (("MEMORY_ADDRESS_PARAMETER_LENGTH", "address_length"), ("MEMORY_SIZE_PARAMETER_LENGTH", "size_length")):
+        lengths = [int(e.text) for e in proto.iter(tag) if (e.text or "").strip()]
+        if lengths:
+            info["memory"][key] = max(lengths)
+    limits = [int(e.text) for e in proto.iter("MAX_ELEMENTS_IN_REQUEST") if (e.text or "").strip()]
+    if limits:
+        # Most conservative across sessions
+        info["max_dids_per_request"] = min(limits)
+    network = proto.find("NETWORK_LAYER")
+    if network is not None:
+        for tag, key in _NETWORK_PARAMETERS.items():
+            # Default session's value where sessions differ
+            for sessions, value in _session_values(network, tag):
+                if "session_01" in sessions or key not in info["network"]:
+                    info["network"][key] = value
+    timing = proto.find("APPLICATION_LAYER/APPLICATION_LAYER_TIMING_PARAMETERS")
+    if timing is not None:
+        for tag, key in _TIMING_PARAMETERS.items():
+            values = [value for _, value in _session_values(timing, tag)]
+            if values:
+                info["timing"][key] = max(values)
+    return info
+
+def build_access_index(dids):
+    # (session, service, access kind) -> frozenset of DIDs, where kind is the ACCESS_PARAMETERS tag
+    # (READABLE/WRITEABLE). None in the service/kind slot matches any, so every query is one lookup.
+    index = {}
+    for num, info in dids.items():
+        if not num:
+            continue
+        did = int(num, 16)
+        for kind, attrs in info["access"].items():
+            services = attrs.get("SERVICE_REFS", "").split()
+            for session in attrs.get("SESSION_REFS", "").split():
+                for service in services + [None]:
+                    for k in (kind, None):
+                        index.setdefault((session, service, k), set()).add(did)
+    return {key: frozenset(v) for key, v in index.items()}
+
+def parse_mdx(file_path, stream=False):
+    if stream:
+        return parse_mdx_stream(file_path)
     tree = ET.parse(file_path)
     root = tree.getroot()
-    data = {"dids": {}, "dtcs": {}}
+    data = {"dids": {}, "dtcs": {}, "snapshot_records": {}, "extended_records": {}, "memory_areas": []}
+    data["ecu"] = {"name": (root.findtext("ADMINISTRATION/ECU_NAME") or "").strip(),
+                   "shortname": (root.findtext("ADMINISTRATION/SHORTNAME") or "").strip()}
+    refs = {}  # MDX element ID -> number
     for did in root.findall(".//DATA_IDENTIFIERS/DID"):
-        number = (did.findtext("NUMBER") or "").strip()
-        name = (did.findtext("NAME") or "").strip()
-        desc = (did.findtext("DESCRIPTION") or "").strip()
-        byte_size = (did.findtext("BYTE_SIZE") or "").strip()
-        did_type = (did.findtext("DID_TYPE") or "").strip()
-        access = {}
-        ap = did.find("ACCESS_PARAMETERS")
-        if ap is not None:
-            for child in ap:
-                access[child.tag] = child.attrib.copy()
-        subfields = []
-        for sf in did.findall("SUB_FIELD"):
-            subfields.append({
-                "name": (sf.findtext("NAME") or "").strip(),
-                "lsb": (sf.findtext("LEAST_SIG_BIT") or "").strip(),
-                "msb": (sf.findtext("MOST_SIG_BIT") or "").strip()
-            })
-        data["dids"][number] = {
-            "number": number, "name": name, "description": desc,
-            "byte_size": byte_size, "did_type": did_type, "access": access,
-            "subfields": subfields
-        }
+        number, info = _parse_did(did)
+        data["dids"][number] = info
+        if number:
+            refs[did.get("ID")] = int(number, 16)
 
     for dtc in root.findall(".//DTC"):
-        base_num = dtc.findtext("NUMBER", "").replace("0x", "").upper().zfill(4)
-        base_desc = dtc.findtext("DESCRIPTION", "").strip()
-
-        for fi in dtc.findall("DTC_FAILURE_INFO"):
-            fi_desc = fi.findtext("DESCRIPTION", "").strip()
-            if fi_desc == "":
-                # fall back to DTC_CONTINUOUS_PARAMETERS / FDC_PASS_FAIL_CRITERIA
-                fi_desc = fi.findtext("DTC_CONTINUOUS_PARAMETERS/FDC_PASS_FAIL_CRITERIA", "").strip().replace("\n\n", "  ")
-            ftb_elem = fi.find("DTC_FTB")
-            if ftb_elem is not None and "FAILURE_REF" in ftb_elem.attrib:
-                ftb = ftb_elem.attrib["FAILURE_REF"].replace("ftb_", "").upper().zfill(2)
-                full_code = f"{base_num}{ftb}"
+        _parse_dtc(dtc, data["dtcs"])
+    for rec in root.iter("DTC_SNAPSHOT_RECORD"):
+        number, info = _parse_snapshot_record(rec)
+        data["snapshot_records"][number] = info
+        refs[rec.get("ID")] = number
+    for rec in root.iter("DTC_EXTENDED_DATA_RECORD"):
+        number, info = _parse_extended_record(rec)
+        data["extended_records"][number] = info
+        refs[rec.get("ID")] = number
+    for area in root.iter("MEMORY_AREA"):
+        data["memory_areas"].append(_parse_memory_area(area))
+    _link_dtc_records(data, refs)
+    data["protocol"] = _parse_protocol(root.find("PROTOCOL"))
+    data["access_index"] = build_access_index(data["dids"])
+    return data
+
+def parse_mdx_stream(file_path):
+    # Same result as parse_mdx, but each DID/DTC is built as soon as its end tag
+    # arrives and then dropped, so the whole document never sits in memory at once
+    data = {"dids": {}, "dtcs": {}, "snapshot_records": {}, "extended_records": {}, "memory_areas": [],
+            "ecu": {"name": "", "shortname": ""}, "protocol": _parse_protocol(None)}
+    refs = {}
+    stack = []
+    keep = 0  # Number of open DID/DTC/PROTOCOL/MEMORY_AREA elements whose children we still need
+    for event, elem in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            wanted = (elem.tag in ("DTC", "DTC_SNAPSHOT_RECORD", "DTC_EXTENDED_DATA_RECORD", "MEMORY_AREA")
+                      or (elem.tag == "DID" and stack and stack[-1][0].tag == "DATA_IDENTIFIERS")
+                      or (elem.tag == "PROTOCOL" and len(stack) == 1))
+            stack.append((elem, wanted))
+            keep += wanted
+            continue
+        _, wanted = stack.pop()
+        if len(stack) == 2 and stack[1][0].tag == "ADMINISTRATION" and elem.tag in ("ECU_NAME", "SHORTNAME"):
+            data["ecu"]["name" if elem.tag == "ECU_NAME" else "shortname"] = (elem.text or "").strip()
+        if wanted:
+            keep -= 1
+            if elem.tag == "DID":
+                number, info = _parse_did(elem)
+                data["dids"][number] = info
+                if number:
+                    refs[elem.get("ID")] = int(number, 16)
+            elif elem.tag == "DTC":
+                _parse_dtc(elem, data["dtcs"])
+            elif elem.tag == "DTC_SNAPSHOT_RECORD":
+                number, info = _parse_snapshot_record(elem)
+                data["snapshot_records"][number] = info
+                refs[elem.get("ID")] = number
+            elif elem.tag == "DTC_EXTENDED_DATA_RECORD":
+                number, info = _parse_extended_record(elem)
+                data["extended_records"][number] = info
+                refs[elem.get("ID")] = number
+            elif elem.tag == "MEMORY_AREA":
+                data["memory_areas"].append(_parse_memory_area(elem))
             else:
-                full_code = base_num
-
-            data["dtcs"][full_code] = {
-                "base_code": base_num,
-                "ftb": full_code[len(base_num):] if len(full_code) > len(base_num) else None,
-                "base_description": base_desc,
-                "failure_description": fi_desc
-            }
+                data["protocol"] = _parse_protocol(elem)
+        if keep == 0:
+            elem.clear()
+            if stack:
+                stack[-1][0].remove(elem)
+    _link_dtc_records(data, refs)
+    data["access_index"] = build_access_index(data["dids"])
     return data
 
-def list_accessible_dids(parsed_data, session_ref='session_01'):
-    out = []
+# Bump whenever the structure returned by parse_mdx changes, so stale caches get rebuilt
+_CACHE_VERSION = 9
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fdiag")
+
+def _cache_path(file_path, cache_dir=None):
+    key = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, f"{key}.mdxc")
+
+def _file_hash(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_mdx(file_path, cache_dir=None):
+    # parse_mdx, but backed by a pickle cache keyed on the MDX's mtime/size and content hash
+    path = _cache_path(file_path, cache_dir)
+    st = os.stat(file_path)
+    header = None
+    sha256 = None  # Hashed at most once, a stale cache needs it for the check and the rewrite
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if header["version"] == _CACHE_VERSION and header["mtime"] == st.st_mtime_ns and header["size"] == st.st_size:
+                return pickle.load(f)
+            # mtime changed (e.g. fresh checkout), only trust the cache if the content is the same
+            if header["version"] == _CACHE_VERSION:
+                sha256 = _file_hash(file_path)
+                if header["sha256"] == sha256:
+                    data = pickle.load(f)
+                    _write_cache(path, file_path, st, sha256, data)
+                    return data
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+    data = parse_mdx(file_path, stream=True)
+    _write_cache(path, file_path, st, sha256 or _file_hash(file_path), data)
+    return data
+
+def _write_cache(path, file_path, st, sha256, data):
+    header = {"version": _CACHE_VERSION, "source": os.path.abspath(file_path),
+              "mtime": st.st_mtime_ns, "size": st.st_size, "sha256": sha256}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # Cache is best-effort, a read-only home directory shouldn't break parsing
+
+def invalidate_cache(file_path=None, cache_dir=None):
+    # Drop the cache entry for one MDX, or every cached MDX if no path is given
+    if file_path is not None:
+        paths = [_cache_path(file_path, cache_dir)]
+    else:
+        d = cache_dir or CACHE_DIR
+        paths = [os.path.join(d, n) for n in os.listdir(d) if n.endswith(".mdxc")] if os.path.isdir(d) else []
+    for p in paths:
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+def did_sizes(parsed_data):
+    # {DID: BYTE_SIZE} as integers, for splitting multi-DID 0x22 responses
+    sizes = {}
     for num, info in parsed_data["dids"].items():
-        access = info.get("access", {})
-        for a in access.values():
-            if session_ref in a.get("SESSION_REFS","").split():
-                out.append(info)
-                break
-    return out
-
-# def interpret_dtc(parsed_data, code):
-#     if isinstance(code, int):
-#         code_norm = hex(code).upper().replace('X','x')
-#     else:
-#         code_norm = str(code).strip().upper()
-#         if not code_norm.startswith("0X"):
-#             try:
-#                 code_norm = hex(int(code)).upper().replace('X','x')
-#             except:
-#                 pass
-#     code_norm = code_norm.replace('0X','0x')
-#     dtc = parsed_data["dtcs"].get(code_norm)
-#     if not dtc:
-#         try:
-#             iv = int(code_norm, 16)
-#             for k,v in parsed_data["dtcs"].items():
-#                 try:
-#                     if int(k,16) == iv:
-#                         dtc = v; break
-#                 except: continue
-#         except: pass
-#     return dtc
-def interpret_dtc(data, code):
-    # Strip leading '0x', uppercase, pad
-    code = code.replace("0x", "").upper()
-    if len(code) == 4:  # base only
-        code = code.zfill(4)
-    elif len(code) <= 6:  # base + ftb
-        code = code[:4].zfill(4) + code[4:].zfill(2)
+        if num and info["byte_size"]:
+            sizes[int(num, 16)] = int(info["byte_size"])
+    return sizes
+
+def accessible_dids(parsed_data, session_ref='session_01', service_ref=None, kind=None) -> frozenset:
+    # e.g. accessible_dids(p, 'session_01', 'service_22', 'READABLE') & accessible_dids(p, 'session_03', kind='WRITEABLE')
+    return parsed_data["access_index"].get((session_ref, service_ref, kind), frozenset())
+
+def list_accessible_dids(parsed_data, session_ref='session_01'):
+    ids = accessible_dids(parsed_data, session_ref)
+    return [info for num, info in parsed_data["dids"].items() if num and int(num, 16) in ids]
 
-    return data["dtcs"].get(code)
+def lookup_dtc(parsed_data, number: int):
+    # MDX entry for a 3-byte DTC number as reported by 0x19, e.g. 0xC02809
+    return parsed_data["dtc_index"].get(number)
+
+def dtc_number(code) -> int | None:
+    """
+    "C02809", "0xC028" (base code, FTB 00), 0xC02809 ... -> 3-byte DTC number, None if unreadable.
+    Codes with a partial FTB are filled out to the right, as the DTC is written.
+
+    >>> [f"{dtc_number(c):06X}" for c in ("C02809", "C0280", "C028", "0xC028", 0xC02809)]
+    ['C02809', 'C02800', 'C02800', 'C02800', 'C02809']
+    """
+    if not isinstance(code, str):
+        return code
+    code = code.strip().upper().replace("0X", "")
+    if len(code) not in (4, 5, 6):
+        return None
+    try:
+        return int(code, 16) << 8 if len(code) == 4 else int(code.ljust(6, "0"), 16)
+    except ValueError:
+        return None
+
+def interpret_dtc(data, code):
+    # Accepts "C02809", "0xC028", 0xC02809 ... and looks it up by number
+    number = dtc_number(code)
+    return lookup_dtc(data, number) if number is not None else None
 
 if __name__ == '__main__':
     import sys, pathlib
     if len(sys.argv) < 2:
-        print("Usage: mdx_tools.py <path_to_mdx> [--list-session session_id] [--dtc CODE]")
+        print("Usage: mdx_tools.py <path_to_mdx> [--stream] [--no-cache] [--list-session session_id] [--dtc CODE]")
         sys.exit(1)
     mdx = sys.argv[1]
-    parsed = parse_mdx(mdx)
+    if '--no-cache' in sys.argv or '--stream' in sys.argv:
+        # Straight from the file, the cache is neither read nor written
+        parsed = parse_mdx(mdx, stream='--stream' in sys.argv)
+    else:
+        parsed = load_mdx(mdx)
     if '--list-session' in sys.argv:
         idx = sys.argv.index('--list-session')+1
         session = sys.argv[idx] if idx < len(sys.argv) else 'session_01'
@@ -112,8 +413,7 @@ if __name__ == '__main__':
         code = sys.argv[idx] if idx < len(sys.argv) else None
         dtc = interpret_dtc(parsed, code)
         if dtc:
-            print(dtc['number'], dtc['description'])
-            for f in dtc['failures']:
-                print("- ", f['description'][:200])
+            print(dtc['base_code'] + (dtc['ftb'] or ''), dtc['base_description'])
+            print("- ", dtc['failure_description'][:200])
         else:
             print("DTC not found:", code)
\ No newline at end of file
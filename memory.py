@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from collections import namedtuple
+from obdlink import CANError
+
+MemoryArea = namedtuple("MemoryArea", ["name", "start", "size"])
+
+class DumpResult(namedtuple("DumpResult", ["area", "offset", "read", "requests", "retries", "seconds"])):
+    """One dump_memory run: `read` bytes from `offset` into the area, over `requests` 0x23 requests."""
+    __slots__ = ()
+
+    @property
+    def rate(self) -> float:
+        # Bytes per second while reading
+        return self.read / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.area.name}: {self.read} bytes in {self.seconds:.2f}s ({self.rate / 1024:.1f} KiB/s), "
+                f"{self.requests} requests, {self.retries} retries")
+
+def memory_areas(parsed_data) -> dict:
+    # MDX MEMORY_AREAS by name
+    return {a["name"]: MemoryArea(a["name"], a["start"], a["size"]) for a in parsed_data["memory_areas"]}
+
+def memory_format(parsed_data) -> tuple:
+    # (address length, size length) for 0x23, 4/4 if the MDX doesn't say
+    memory = parsed_data["protocol"].get("memory", {})
+    return memory.get("address_length", 4), memory.get("size_length", 4)
+
+def chunk_size(adapter, address_length: int = 4, size_length: int = 4) -> int:
+    # Largest read that fits one response (0x63 + data), i.e. the ECU's MAX_MSG_SIZE once the
+    # adapter has been through configure_isotp()
+    if 2 + address_length + size_length > adapter.max_request:
+        raise ValueError("Adapter can't send a 0x23 request, configure ISO-TP first")
+    return adapter.max_response - 1
+
+def dump_memory(diag, target: bytes | int, area: MemoryArea, out, parsed_data=None, offset: int = 0,
+                chunk: int | None = None, progress=None, retries: int = 3) -> DumpResult:
+    """
+    Reads a memory area with ReadMemoryByAddress (0x23) in the largest chunks the transport takes,
+    each one written out as soon as it arrives.
+
+    `out` is a path, a writable buffer (bytearray, mmap, memoryview) at least area.size long, or a
+    file object positioned where `offset` goes. Dumps to a path resume by themselves: the file only
+    ever holds data read so far, and a "<path>.part" marker says which area it's for, so after an
+    interruption the next call picks up at the file's length. Buffers resume from `offset`.
+
+    progress(done, total, rate) is called after every chunk. Timeouts and CAN errors are retried
+    `retries` times per chunk, negative responses raise ValueError.
+    """
+    address_length, size_length = memory_format(parsed_data) if parsed_data is not None else (4, 4)
+    chunk = chunk or chunk_size(diag.adapter, address_length, size_length)
+
+    if isinstance(out, (str, os.PathLike)):
+        marker = f"{os.fspath(out)}.part"
+        target_id = int.from_bytes(target, byteorder='big') if isinstance(target, bytes) else target
+        identity = {"target": target_id, "start": area.start, "size": area.size}
+        offset = _resume_offset(out, marker, identity)
+        if offset >= area.size:
+            return DumpResult(area, area.size, 0, 0, 0, 0.0)
+        with open(out, "ab") as f:
+            def write(data):
+                # Buffered writes take the whole chunk, flushed straight away since the file's length
+                # is where an interrupted dump resumes
+                f.write(data)
+                f.flush()
+
+            result = _dump(diag, target, area, write, offset, chunk, address_length, size_length, progress, retries)
+        os.remove(marker)
+        return result
+
+    if hasattr(out, "write"):
+        return _dump(diag, target, area, out.write, offset, chunk, address_length, size_length, progress, retries)
+
+    view = memoryview(out).cast("B")
+    if len(view) < area.size:
+        raise ValueError(f"Buffer is {len(view)} bytes, {area.name} needs {area.size}")
+    position = [offset]
+
+    def write(data):
+        view[position[0]:position[0] + len(data)] = data
+        position[0] += len(data)
+
+    return _dump(diag, target, area, write, offset, chunk, address_length, size_length, progress, retries)
+
+def _resume_offset(path, marker: str, identity: dict) -> int:
+    try:
+        with open(marker) as f:
+            if json.load(f) == identity:
+                return os.path.getsize(path)
+    except (OSError, ValueError):
+        pass
+    if not os.path.exists(marker) and os.path.exists(path) and os.path.getsize(path) == identity["size"]:
+        return identity["size"]  # Finished earlier
+    # Fresh dump, or leftovers from a different area
+    with open(marker, "w") as f:
+        json.dump(identity, f)
+    open(path, "wb").close()
+    return 0
+
+def _dump(diag, target, area: MemoryArea, write, offset: int, chunk: int, address_length: int,
+          size_length: int, progress, retries: int) -> DumpResult:
+    requests = failures = 0
+    done = offset
+    start = time.perf_counter()
+    while done < area.size:
+        size = min(chunk, area.size - done)
+        for attempt in range(retries + 1):
+            requests += 1
+            try:
+                data = diag.read_memory_by_address(target, area.start + done, size, address_length, size_length)
+                break
+            except CANError:
+                # Includes ResponseTimeout, the ECU may just have been busy
+                failures += 1
+                if attempt == retries:
+                    raise
+        if len(data) != size:
+            raise ValueError(f"Asked for {size} bytes at 0x{area.start + done:X}, got {len(data)}")
+        write(data)
+        done += size
+        if progress is not None:
+            elapsed = time.perf_counter() - start
+            progress(done, area.size, (done - offset) / elapsed if elapsed else 0.0)
+    return DumpResult(area, offset, done - offset, requests, failures, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    import sys
+    from mdx import load_mdx
+    from obdlink import OBDLink, UDS
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <mdx_file> [<port> <area> <out_file>]")
+        sys.exit(1)
+    parsed = load_mdx(sys.argv[1])
+    areas = memory_areas(parsed)
+    if len(sys.argv) < 5:
+        for a in areas.values():
+            print(f"{a.name}: 0x{a.start:X}-0x{a.start + a.size - 1:X} ({a.size} bytes)")
+        sys.exit(0)
+    elm = OBDLink(sys.argv[2])
+    elm.connect()
+    elm.defaults()
+    elm.configure_isotp(parsed["protocol"]["network"])
+    try:
+        result = dump_memory(UDS(elm), 0x716, areas[sys.argv[3]], sys.argv[4], parsed,
+                             progress=lambda done, total, rate: print(f"\r{done}/{total} bytes, {rate / 1024:.1f} KiB/s",
+                                                                      end="", flush=True))
+        print()
+        print(result)
+    finally:
+        elm.disconnect()
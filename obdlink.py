@@ -1,23 +1,134 @@
 import serial
 from serial.tools import list_ports
 import time
+import asyncio
+import logging
+from dtc import parse_dtc_records
+from timing import CommandTiming, AdaptiveTimeout, command_kind, stpx_target
+from isotp import (ISOTPError, NetworkParameters, DEFAULT_PARAMETERS, network_parameters, segment, pad,
+                   flow_control, parse_flow_control, parse_segmented, Reassembler,
+                   SINGLE_FRAME, CONTINUE_TO_SEND, OVERFLOW)
+
+log = logging.getLogger(__name__)
 
 class CANError(Exception):
     """Custom exception for CAN-related errors."""
     pass
 
+class ResponseTimeout(CANError):
+    """Raised when the ECU doesn't answer a request within its response timeout (NO DATA)."""
+    pass
+
+class AdapterTimeout(serial.SerialException):
+    """Raised when the adapter doesn't finish a response (no ">" prompt) within command_timeout."""
+    pass
+
+def format_response(raw: bytes) -> str:
+    # Everything the adapter sent up to and including the ">" prompt, minus the prompt itself
+    return raw.decode('utf-8').replace('\r', '\n').replace('\n\n>', '').strip()
+
+def parse_obd_response(resp: str) -> bytes:
+    if resp == "CAN ERROR":
+        raise CANError()
+    if resp == "NO DATA":
+        return b""
+    if "\n" in resp:
+        # Response pending (7F xx 78) lines ahead of the real answer
+        lines = resp.split("\n")
+        while len(lines) > 1 and _is_pending(lines[0]):
+            lines.pop(0)
+        resp = "\n".join(lines)
+    if "\n" in resp:
+        # Multi-frame response as the adapter formats it with CAN auto formatting on
+        return parse_segmented(resp.split("\n"))
+    return bytes.fromhex(resp)
+
+def _is_pending(line: str) -> bool:
+    line = line.replace(" ", "").upper()
+    return len(line) == 6 and line.startswith("7F") and line.endswith("78")
+
+def _is_pending_response(response: bytes) -> bool:
+    # A lone 7F xx 78: the ECU needs longer than P2 and the adapter stopped listening after it
+    return len(response) == 3 and response[0] == 0x7F and response[2] == 0x78
+
+# Services that can be sent again to hear the end of a response pending: reads only. A repeated
+# 0x2C appends to the definition, 0x2E writes twice and 0x31 starts the routine again.
+_REPEATABLE_SERVICES = frozenset((0x19, 0x22, 0x23))
+
+def check_send_result(responses: list):
+    if responses[-1] == "CAN ERROR":
+        raise CANError()
+
+def _raw_frames(resp: str) -> list:
+    # Lines received with CAN auto formatting off, one frame's data bytes each
+    if resp == "CAN ERROR":
+        raise CANError()
+    if resp in ("NO DATA", ""):
+        return []
+    return [bytes.fromhex(line) for line in resp.split("\n")]
+
+def _st_command(seconds: float) -> str:
+    # ATST counts in 4ms steps
+    return f"ATST{max(1, min(0xFF, -(-int(seconds * 1000) // 4))):02X}"
+
 class ELM327:
+    # Largest request/response payload the adapter can carry. Plain ELM327 only sends single
+    # frames until configure_isotp() hands longer requests to the software ISO-TP layer.
+    max_request = 7
+    max_response = 7
+    # Adapter segments long requests itself (STPX), no software ISO-TP needed
+    hardware_segmentation = False
+    # Receive block size for software ISO-TP: the most frames the adapter can be told to wait for
+    receive_block_size = 15
+    # Serial read timeout: longest any one command may take to come back with a prompt, comfortably
+    # above P2* (5s) and a 4095 byte transfer at the slowest baud rate
+    command_timeout = 10.0
+    # P2*: how long an ECU that has answered response pending (7F xx 78) may take to finish, ISO
+    # 14229-2's default until configure_timing() has the MDX's P2_STAR_MAX
+    pending_timeout = 5.0
+
     def __init__(self, port, baud):
         self.port = port
         self.baud = baud
         self.ser = None
+        self._async = None  # AsyncAdapter driving this port from a background event loop, if any
+        self._monitoring = False
+        self.hooks = []  # Callables taking a timing.CommandTiming for every command and UDS request
+        self.isotp = None  # isotp.NetworkParameters once configure_isotp() has been called
+        self.timeouts = None  # timing.AdaptiveTimeout once configure_timing() has been called
+        self._st = None  # Last ATST command sent, None while the adapter is on its default
 
-    def connect(self):
-        self.ser = serial.Serial(self.port, self.baud, timeout=None) # No timeout is set
+    def connect(self, transport=None):
+        # Any serial-like object (write/read/read_until/in_waiting/timeout) can stand in for the
+        # port, e.g. sim.SimulatedAdapter or sim.ReplayTransport
+        if transport is not None:
+            self.ser = transport
+            self.ser.timeout = self.command_timeout
+            return
+        self.ser = serial.Serial(self.port, self.baud, timeout=self.command_timeout)
 
     def disconnect(self):
-        if self.ser and self.ser.is_open:
-            self.ser.close()
+        try:
+            self.stop_background()
+        finally:
+            if self.ser and self.ser.is_open:
+                self.ser.close()
+
+    def start_background(self):
+        # Hand the port to an asyncio reader/writer running in its own thread. The synchronous
+        # methods keep working (from any thread) and are queued alongside async callers.
+        if self._async is None:
+            from aio import AsyncAdapter
+            AsyncAdapter(self).start_in_thread()
+        return self._async
+
+    def stop_background(self):
+        if self._async is None:
+            return
+        if self._async._thread is None:
+            # Started with `await AsyncAdapter.start()`, its loop belongs to the caller
+            raise RuntimeError("Adapter loop is running on the caller's event loop, await its stop() instead")
+        self._async.stop_thread()
 
     def defaults(self):
         # Some sane default settings to make things work nicely
@@ -26,29 +137,307 @@ class ELM327:
         self.allow_long_messages()
 
     def write_command(self, command: str, expect_echo: bool = True) -> str:
+        if self._async is not None:
+            return self._async.call(self._async.write_commands([command], expect_echo))[0]
         if not self.ser or not self.ser.is_open:
             raise serial.SerialException("Serial port is not open.")
+        t0 = time.perf_counter()
         self.ser.write((command + '\r\n').encode('utf-8'))
+        t1 = time.perf_counter()
         if expect_echo:
             self.ser.read_until(b"\r")
-        resp =  self.ser.read_until(b">").decode('utf-8').replace('\r', '\n').replace('\n\n>', '').strip()
-        #print(f"Command: {command}, Response: {resp}")
+        t2 = time.perf_counter()
+        raw = self.ser.read_until(b">")
+        t3 = time.perf_counter()
+        if not raw.endswith(b">"):
+            raise AdapterTimeout(f"No prompt from the adapter within {self.ser.timeout}s after {command!r}")
+        resp = format_response(raw)
+        if self.hooks:
+            self._emit_command(command, t0, (t1 - t0, t2 - t1, t3 - t2, time.perf_counter() - t3))
         return resp
-    
+
+    def _emit_command(self, command: str, start: float, phases: tuple):
+        kind = command_kind(command)
+        event = CommandTiming(kind, stpx_target(command) if kind == "STPX" else None, command,
+                              time.perf_counter() - start, phases, None)
+        for hook in self.hooks:
+            hook(event)
+
+    def _emit_request(self, header: bytes | int, data: bytes, start: float, response: bytes | None):
+        nrc = response[2] if response and len(response) >= 3 and response[0] == 0x7F else None
+        event = CommandTiming(f"UDS {data[0]:02X}", _target_key(header), data.hex().upper(),
+                              time.perf_counter() - start, None, nrc)
+        for hook in self.hooks:
+            hook(event)
+
+    def _transact(self, commands: list) -> list:
+        # Commands that have to reach the adapter back-to-back (e.g. header + request)
+        if self._async is not None:
+            return self._async.call(self._async.write_commands(commands))
+        responses = []
+        for command in commands:
+            if self._setting_unchanged(command):
+                responses.append("OK")
+                continue
+            responses.append(self.write_command(command))
+            self._setting_sent(command, responses[-1])
+        return responses
+
+    def _setting_unchanged(self, command: str) -> bool:
+        # ATST only goes out when it changes. Decided where commands are serialized (here and in
+        # AsyncAdapter's writer), so concurrent callers can't both count on the other sending it.
+        return command.startswith("ATST") and command == self._st
+
+    def _setting_sent(self, command: str, response: str):
+        if command.startswith("ATST") and response == "OK":
+            self._st = command
+
     def write_obd(self, header: bytes | int, data: bytes) -> bytes:
-        # This won't work properly if response is segmented (with ISO-TP)!
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self._exchange(header, data)
+            retry = self._retry_timeout(header, response)
+            if retry is not None:
+                response = self._exchange(header, data, retry)
+            pending = _is_pending_response(response)
+            if pending:
+                # Ask again, this time listening past the pending line for up to P2*. The wait
+                # says nothing about the ECU's usual latency, so it isn't observed.
+                self._check_repeatable(header, data)
+                deadline = time.monotonic() + self.pending_timeout
+                while _is_pending_response(response) and time.monotonic() < deadline:
+                    response = self._exchange(header, data, self.pending_timeout, responses=2)
+            self._check_response(header, data, response, start, observe=not pending)
+            return response
+        finally:
+            if self.hooks:
+                self._emit_request(header, data, start, response)
+
+    def _exchange(self, header: bytes | int, data: bytes, timeout: float | None = None, responses: int = 1) -> bytes:
+        if self._software_isotp(data):
+            return self._write_segmented(header, data)
+        return self._obd_result(self._transact(self._obd_commands(header, data, timeout=timeout, responses=responses)))
+
+    def _check_repeatable(self, header: bytes | int, data: bytes):
+        # The adapter has stopped listening by the time a lone response pending comes back, and the
+        # only way to hear the final response is to send the request again
+        if data[0] not in _REPEATABLE_SERVICES:
+            raise ResponseTimeout(f"{_target_key(header):X} answered {data.hex().upper()} with response pending, "
+                                  "and it isn't safe to send again")
+
+    def _retry_timeout(self, header: bytes | int, response: bytes) -> float | None:
+        # NO DATA under a learned timeout shorter than P2 may just have been too tight,
+        # the request gets one more go with the ECU's full allowance
+        if response or self.timeouts is None:
+            return None
+        ceiling = self.timeouts.ceiling
+        return ceiling if self.timeouts.timeout(_target_key(header)) < ceiling else None
+
+    def _check_response(self, header: bytes | int, data: bytes, response: bytes, start: float, observe: bool = True):
+        if not response:
+            raise ResponseTimeout(f"No response from {_target_key(header):X} to {data.hex().upper()}")
+        if observe and self.timeouts is not None:
+            self.timeouts.observe(_target_key(header), time.perf_counter() - start)
+
+    def send_obd(self, header: bytes | int, data: bytes):
+        # For requests the ECU won't answer (suppressPosRspMsgIndicationBit set)
+        start = time.perf_counter()
+        try:
+            if self._software_isotp(data):
+                self._write_segmented(header, data, expect_response=False)
+            else:
+                check_send_result(self._transact(self._obd_commands(header, data, expect_response=False)))
+        finally:
+            if self.hooks:
+                self._emit_request(header, data, start, None)
+
+    def _obd_commands(self, header: bytes | int, data: bytes, expect_response: bool = True,
+                      timeout: float | None = None, responses: int = 1) -> list:
+        # Single frame requests. The ELM327 reassembles segmented responses itself (sending flow
+        # control as set up by configure_isotp()) and parse_obd_response() puts them back together.
+        # Plain ELM327 can't be told to expect no reply, so it sits out its NO DATA timeout either way
+        commands = [f"ATSH{header.hex().upper() if isinstance(header, bytes) else f'{header:06X}'}"]
+        timeout = self._response_timeout(header) if timeout is None else timeout
+        if timeout is not None:
+            # ATST is the adapter's wait for the first frame of a response, dropped by _transact if unchanged
+            commands.append(_st_command(timeout))
+        # A trailing digit tells the adapter how many responses to wait for
+        commands.append(data.hex().upper() + (f"{responses:X}" if responses > 1 else ""))
+        return commands
+
+    def _response_timeout(self, header: bytes | int) -> float | None:
+        return self.timeouts.timeout(_target_key(header)) if self.timeouts is not None else None
+
+    def configure_timing(self, timing: dict, delta_p2: int | None = None) -> AdaptiveTimeout:
+        # Response timeouts learned per target, capped by the ECU's P2 (mdx "protocol"/"timing",
+        # plus "network"/"delta_p2" for bus delays). Targets that answer quickly stop costing the
+        # adapter's 200ms default every time they don't.
+        p2 = timing.get("p2_max") or 50
+        self.timeouts = AdaptiveTimeout((p2 + (delta_p2 or 0)) / 1000)
+        if timing.get("p2_star_max"):
+            self.pending_timeout = (timing["p2_star_max"] + (delta_p2 or 0)) / 1000
+        return self.timeouts
+
+    def _obd_result(self, responses: list) -> bytes:
+        assert responses[0] == "OK", "Failed to set header"
+        return parse_obd_response(responses[-1])
+
+    def configure_isotp(self, network: dict | NetworkParameters | None = None) -> NetworkParameters:
+        # Take the ECU's ISO-TP parameters (mdx "protocol"/"network", or NetworkParameters) for
+        # multi-frame messages, lifting the single frame limits up to its MAX_MSG_SIZE
+        params = network if isinstance(network, NetworkParameters) else network_parameters(network)
+        self.isotp = params
+        if self.hardware_segmentation:
+            self.max_request = min(type(self).max_request, params.max_msg_size)
+            self.max_response = min(type(self).max_response, params.max_msg_size)
+            return params
+        self.max_request = self.max_response = params.max_msg_size
+        # Flow control the adapter sends for segmented responses: no block limit, but frames
+        # spaced by how long it takes to print one, so a long response can't overrun its buffer
+        fc = flow_control(CONTINUE_TO_SEND, 0, self.receive_st_min)
+        assert self.write_command(f"ATFCSD{fc.hex().upper()}") == "OK", "Failed to set flow control data"
+        assert self.write_command("ATFCSM2") == "OK", "Failed to set flow control mode"
+        return params
+
+    @property
+    def receive_st_min(self) -> float:
+        # Serial time for one received frame: 16 hex digits, sequence digit and CR, 10 bits a character
+        return 18 * 10 / self.baud
+
+    def _software_isotp(self, data: bytes) -> bool:
+        return len(data) > 7 and not self.hardware_segmentation
+
+    def _write_segmented(self, header: bytes | int, data: bytes, expect_response: bool = True) -> bytes:
+        # Software ISO-TP for requests longer than a single frame. With CAN auto formatting off
+        # every line sent is one CAN frame and every line received is one frame's data. A trailing
+        # digit on a line tells the adapter how many frames to wait for, so it returns as soon as
+        # they are in instead of sitting out its timeout.
+        if self._async is not None:
+            raise RuntimeError("Multi-frame requests need the port to themselves, stop the background loop first")
+        if len(data) > self.max_request:
+            raise ISOTPError(f"{len(data)} byte request exceeds the ECU's MAX_MSG_SIZE {self.max_request}")
+        params = self.isotp or DEFAULT_PARAMETERS
         if isinstance(header, int):
             header = header.to_bytes(3, byteorder='big')
+        frames = segment(data)
         self._set_header(header)
-        resp = self.write_command(data.hex().upper())
-        if resp == "CAN ERROR":
-            raise CANError()
-        if resp == "NO DATA":
+        assert self.write_command("ATCAF0") == "OK", "Failed to disable CAN auto formatting"
+        try:
+            # N_Bs: how long the ECU may take with each flow control
+            assert self.write_command(_st_command(params.n_bs)) == "OK", "Failed to set timeout"
+            received = _raw_frames(self.write_command(pad(frames[0]).hex().upper() + "1"))
+            if not received:
+                raise ISOTPError("No flow control from the ECU within N_Bs")
+            if received[0][0] >> 4 == SINGLE_FRAME:
+                # Refused outright, e.g. 7F <sid> 13
+                return Reassembler().feed(received[0])
+            fc = parse_flow_control(received[0])
+            block = 0
+            last_sent = time.monotonic()
+            replies = True
+            for n, frame in enumerate(frames[1:], start=1):
+                if fc.status == OVERFLOW:
+                    raise ISOTPError(f"ECU can't take a {len(data)} byte request")
+                if fc.status != CONTINUE_TO_SEND:
+                    raise ISOTPError("Flow control WAIT isn't supported by the adapter")
+                block += 1
+                last = n == len(frames) - 1
+                block_end = not last and fc.bs and block == fc.bs
+                wants_reply = block_end or (last and expect_response)
+                if wants_reply != replies:
+                    # Intermediate frames go out without waiting for anything to come back
+                    assert self.write_command("ATR1" if wants_reply else "ATR0") == "OK", "Failed to set responses"
+                    replies = wants_reply
+                # Separation time is the larger of what the ECU asked for and what its MDX says
+                time.sleep(max(0.0, max(fc.st_min, params.st_min) - (time.monotonic() - last_sent)))
+                received = _raw_frames(self.write_command(pad(frame).hex().upper() + ("1" if wants_reply else "")))
+                last_sent = time.monotonic()
+                if block_end:
+                    if not received:
+                        raise ISOTPError("No flow control from the ECU within N_Bs")
+                    fc = parse_flow_control(received[0])
+                    block = 0
+            if not expect_response:
+                return b""
+            if not replies:
+                assert self.write_command("ATR1") == "OK", "Failed to set responses"
+            return self._receive_segmented(received, params)
+        finally:
+            self.write_command("ATR1")
+            self.write_command(self._st or "ATST32")
+            self.write_command("ATCAF1")
+
+    def _receive_segmented(self, received: list, params: NetworkParameters) -> bytes:
+        # Response to a software ISO-TP request, with CAN auto formatting still off: a single frame,
+        # or a first frame after which flow control is sent a block at a time
+        if not received:
             return b""
-        return bytes.fromhex(resp)
+        rx = Reassembler(params.max_msg_size)
+        response = rx.feed(received[0])
+        if response is not None:
+            return response
+        # N_Cr: how long the ECU may leave between consecutive frames
+        assert self.write_command(_st_command(params.n_cr)) == "OK", "Failed to set timeout"
+        while response is None:
+            count = min(rx.remaining, self.receive_block_size)
+            fc = flow_control(CONTINUE_TO_SEND, self.receive_block_size, self.receive_st_min)
+            frames = _raw_frames(self.write_command(pad(fc).hex().upper() + f"{count:X}"))
+            if len(frames) < count:
+                raise ISOTPError(f"Only {len(frames)} of {count} consecutive frames within N_Cr")
+            for frame in frames:
+                response = rx.feed(frame)
+        return response
+
+    def monitor(self, can_id: int, ready=None):
+        # Yields the data bytes of every frame received from `can_id` (ATMA behind a receive filter).
+        # Nothing can be sent while the adapter is monitoring, stop_monitor() ends it from any thread
+        # once ATMA is out, which is when `ready` (a threading.Event) gets set.
+        if self._async is not None:
+            raise RuntimeError("Stop the background loop before monitoring, it owns the port")
+        assert self.write_command("ATH1") == "OK", "Failed to enable headers"
+        assert self.write_command("ATCAF0") == "OK", "Failed to disable CAN auto formatting"
+        assert self.write_command(f"ATCRA{can_id:03X}") == "OK", "Failed to set receive filter"
+        header = f"{can_id:03X}"
+        self._monitoring = True
+        self.ser.write(b"ATMA\r\n")
+        if ready is not None:
+            ready.set()
+        self.ser.read_until(b"\r")  # Echo
+        try:
+            while True:
+                line = self.ser.read_until(b"\r").decode("utf-8", errors="replace").strip().replace(" ", "")
+                if line in ("STOPPED", "BUFFERFULL") or line.startswith(">"):
+                    self._monitoring = False
+                    if not line.startswith(">"):
+                        self.ser.read_until(b">")
+                    break
+                if line.startswith(header):
+                    try:
+                        yield bytes.fromhex(line[len(header):])
+                    except ValueError:
+                        pass  # Partial line
+        finally:
+            if self._monitoring:
+                # Consumer stopped iterating, take the adapter out of monitor mode ourselves
+                self._monitoring = False
+                self.ser.write(b" ")
+                self.ser.read_until(b">")
+            self._monitoring = False
+            self.write_command("ATCRA")
+            self.write_command("ATCAF1")
+            self.write_command("ATH0")
+
+    def stop_monitor(self):
+        # Any character interrupts ATMA and the adapter answers with STOPPED and a prompt. A space
+        # rather than CR, in case monitoring already ended: a bare CR would repeat the last command.
+        if self._monitoring:
+            self._monitoring = False
+            self.ser.write(b" ")
 
     def reset(self):
         assert self.write_command("ATZ")
+        self._st = None  # Back on the default timeout
 
     def _set_header(self, header: bytes):
         assert self.write_command(f"ATSH{header.hex().upper()}") == "OK", "Failed to set header"
@@ -65,23 +454,102 @@ class ELM327:
         assert self.write_command("ATL1") == "OK", "Failed to allow long messages"
     
 class OBDLink(ELM327):
+    # ISO-TP limit, STPX and STCSEGR1 handle segmentation in both directions
+    max_request = 4095
+    max_response = 4095
+    hardware_segmentation = True
+
+    # UART rates to try at connect time, fastest first. STN chips go up to 10Mbps, USB-serial
+    # bridges and cabling usually give out well before that.
+    uart_rates = (2000000, 1000000, 500000, 230400)
+    # Serial read timeout while negotiating, ATI comes back in a few ms at any of these rates
+    negotiate_timeout = 0.5
+
     def __init__(self, port):
         super().__init__(port, 115200)
 
     def defaults(self):
         super().defaults()
         self.enable_segmentation()
+        self.negotiate_baud()
 
-    def write_obd(self, header: bytes | int, data: bytes) -> bytes:
+    def negotiate_baud(self, rates: tuple | None = None, checks: int = 8) -> int:
+        # Link tuning: step the UART up to the fastest rate that both ends switch to and that
+        # then survives `checks` ATI round trips unchanged. Returns the rate the link ended up at.
+        if self._async is not None:
+            raise RuntimeError("Stop the background loop before changing baud rate, it owns the port")
+        if not hasattr(self.ser, "baudrate"):
+            return self.baud  # Recording or replaying, the rate is whatever it was
+        ident = self.write_command("ATI")
+        # A rate that doesn't work shouldn't cost command_timeout per attempt
+        timeout, self.ser.timeout = self.ser.timeout, self.negotiate_timeout
+        try:
+            for rate in rates or self.uart_rates:
+                if rate <= self.ser.baudrate:
+                    break
+                previous = self.ser.baudrate
+                if not self._switch_baud(rate, ident):
+                    continue
+                try:
+                    stable = all(self.write_command("ATI") == ident for _ in range(checks))
+                except (AdapterTimeout, UnicodeDecodeError):
+                    stable = False  # Nothing back, or noise that happened to end in ">"
+                if stable:
+                    break
+                # Handshake went through but the link isn't clean at this rate, go back down
+                if not self._switch_baud(previous, None):
+                    raise serial.SerialException(f"Lost the adapter switching back to {previous} baud")
+        finally:
+            self.ser.timeout = timeout
+        self.baud = self.ser.baudrate
+        return self.baud
+
+    def _switch_baud(self, rate: int, ident: str | None) -> bool:
+        # STBR handshake: the adapter says OK at the old rate, switches and sends its ID string at
+        # the new one. A CR back within its STBRT window (75ms) makes it stick, otherwise the
+        # adapter drops back to the old rate on its own.
+        previous = self.ser.baudrate
+        self.ser.write(f"STBR{rate}\r".encode("utf-8"))
+        self.ser.read_until(b"\r")  # Echo
+        if self.ser.read_until(b"\r").strip() != b"OK":
+            self.ser.read_until(b">")
+            return False
+        timeout, self.ser.timeout = self.ser.timeout, 0.05
+        try:
+            try:
+                self.ser.baudrate = rate
+            except (serial.SerialException, ValueError):
+                received = ""  # The driver won't do this rate, leave the adapter to fall back
+            else:
+                received = self.ser.read_until(b"\r").decode("utf-8", errors="replace").strip()
+            if received and (ident is None or received == ident):
+                self.ser.write(b"\r")
+                self.ser.timeout = timeout
+                if self.ser.read_until(b">").strip().startswith(b"OK"):
+                    return True
+            # Let the adapter time out and fall back, then follow it
+            self.ser.baudrate = previous
+            self.ser.timeout = 0.2
+            self.ser.read_until(b">")
+            self.ser.reset_input_buffer()
+            return False
+        finally:
+            self.ser.timeout = timeout
+
+    def _obd_commands(self, header: bytes | int, data: bytes, expect_response: bool = True,
+                      timeout: float | None = None, responses: int = 1) -> list:
         if isinstance(header, int):
             # STPX won't accept 3-byte headers?
             header = header.to_bytes(2, byteorder='big')
-        resp = self.write_command(f"STPXh:{header.hex().upper()},d:{data.hex().upper()},r:1")
-        if resp == "CAN ERROR":
-            raise CANError()
-        if resp == "NO DATA":
-            return b""
-        return bytes.fromhex(resp)
+        command = f"STPXh:{header.hex().upper()},d:{data.hex().upper()},r:{responses if expect_response else 0}"
+        timeout = self._response_timeout(header) if timeout is None else timeout
+        if timeout is not None and expect_response:
+            # Per-request response timeout in milliseconds, nothing to set up beforehand
+            command += f",t:{max(1, round(timeout * 1000))}"
+        return [command]
+
+    def _obd_result(self, responses: list) -> bytes:
+        return parse_obd_response(responses[0])
 
     def device_id(self):
         response = self.write_command("STDI")
@@ -113,21 +581,187 @@ class OBDLink(ELM327):
         command = f"STCAFCP{pair[0].upper()},{pair[1].upper()}"
         assert self.write_command(command) == "OK", f"Failed to add flow control address pair {pair}"
         
+def _split_rdbi_response(response: bytes, sizes: dict, requested: list) -> dict | None:
+    # 0x62 followed by (DID, data) pairs in request order, None if it doesn't line up with the MDX sizes
+    out = {}
+    i = 1
+    while i < len(response):
+        if i + 2 > len(response):
+            return None
+        identifier = int.from_bytes(response[i:i+2], byteorder='big')
+        if identifier not in requested or identifier in out:
+            return None
+        end = i + 2 + sizes[identifier]
+        if end > len(response):
+            return None
+        out[identifier] = response[i+2:end]
+        i = end
+    return out
+
+def _target_key(target: bytes | int) -> int:
+    return int.from_bytes(target, byteorder='big') if isinstance(target, bytes) else target
+
+def _failure(task) -> BaseException | None:
+    # Exception a finished keepalive task (asyncio.Task or concurrent Future) ended with
+    if not task.done() or task.cancelled():
+        return None
+    return task.exception()
+
+def _periodic_id(identifier: int) -> int:
+    # 0x2A addresses DIDs 0xF200-0xF2FF by their low byte
+    if identifier >> 8 not in (0x00, 0xF2):
+        raise ValueError(f"0x{identifier:04X} is not a periodic DID (0xF200-0xF2FF)")
+    return identifier & 0xFF
+
 class UDS:
     def __init__(self, adapter: OBDLink):
         self.adapter = adapter
+        self._last_activity = {}  # target -> time.monotonic() of the last request that reached it
+        self._keepalives = {}
+        self._dynamic = {}  # (target, dynamic DID) -> sources it was last defined with
+        self.capture = None  # Sink with append(DID, raw) for every DID read, see capture.CaptureWriter
+
+    def _request(self, target: bytes | int, data: bytes) -> bytes:
+        self._check_keepalive(_target_key(target))
+        response = self.adapter.write_obd(target, data)
+        self._last_activity[_target_key(target)] = time.monotonic()
+        return response
 
     def read_data_by_identifier(self, target: bytes | int, identifier: int) -> bytes:
-        response = self.adapter.write_obd(target, b"\x22" + identifier.to_bytes(2, byteorder='big'))
+        response = self._request(target, b"\x22" + identifier.to_bytes(2, byteorder='big'))
         if response.startswith(b"\x62"):
             data = response[3:]
+            if self.capture is not None:
+                self.capture.append(identifier, data)
             return data
         else:
             raise ValueError("Failed to read data by identifier", response.hex())
 
+    def read_data_by_identifiers(self, target: bytes | int, identifiers: list, sizes: dict, max_per_request: int | None = None,
+                                 errors: dict | None = None) -> dict:
+        # Packs several DIDs into each 0x22 request, as far as the MDX sizes, the adapter's message
+        # limits and the ECU's MAX_ELEMENTS_IN_REQUEST allow. DIDs the ECU doesn't return are left out,
+        # and if `errors` is given it collects {DID: NRC} for the ones that were refused, with None
+        # as the NRC for ones that got no answer at all.
+        max_request = self.adapter.max_request
+        max_response = self.adapter.max_response
+        batches = []
+        batch, length = [], 1
+        for identifier in identifiers:
+            size = sizes.get(identifier)
+            if size is None or 3 + size > max_response:
+                # Unknown size can't be split out of a combined response
+                batches.append([identifier])
+                continue
+            if batch and (length + 2 + size > max_response
+                          or 3 + 2 * len(batch) > max_request
+                          or (max_per_request and len(batch) >= max_per_request)):
+                batches.append(batch)
+                batch, length = [], 1
+            batch.append(identifier)
+            length += 2 + size
+        if batch:
+            batches.append(batch)
+
+        results = {}
+        for batch in batches:
+            if len(batch) > 1:
+                request = b"\x22" + b"".join(i.to_bytes(2, byteorder='big') for i in batch)
+                try:
+                    response = self._request(target, request)
+                except CANError:
+                    response = b""  # Some ECUs ignore requests they can't take, try one at a time
+                split = _split_rdbi_response(response, sizes, batch) if response.startswith(b"\x62") else None
+                if split is not None:
+                    results.update(split)
+                    if errors is not None:
+                        # ECUs leave out DIDs they don't support in the active session
+                        for identifier in batch:
+                            if identifier not in split:
+                                errors[identifier] = 0x31
+                    continue
+            # Batch rejected (or a single DID), fall back to one request per DID
+            for identifier in batch:
+                try:
+                    response = self._request(target, b"\x22" + identifier.to_bytes(2, byteorder='big'))
+                except CANError:
+                    # One silent DID shouldn't cost the ones already read
+                    if errors is not None:
+                        errors[identifier] = None
+                    continue
+                if response.startswith(b"\x62"):
+                    results[identifier] = response[3:]
+                elif errors is not None and len(response) >= 3 and response[0] == 0x7F:
+                    errors[identifier] = response[2]
+        if self.capture is not None:
+            for identifier, data in results.items():
+                self.capture.append(identifier, data)
+        return results
+
+    def define_dynamic_identifier(self, target: bytes | int, dynamic_id: int, sources: list, force: bool = False):
+        # 0x2C defineByIdentifier, sources are (DID, 1-based byte position, size). Skipped if the DID
+        # is already defined that way. Long definitions go out over several requests, each one
+        # appends to what the previous ones defined.
+        key = (_target_key(target), dynamic_id)
+        sources = tuple(sources)
+        if not force and self._dynamic.get(key) == sources:
+            return
+        per_request = (self.adapter.max_request - 4) // 4
+        if per_request < 1:
+            raise ValueError("Adapter can't send a 0x2C definition in one frame")
+        self.clear_dynamic_identifier(target, dynamic_id)
+        for i in range(0, len(sources), per_request):
+            request = b"\x2C\x01" + dynamic_id.to_bytes(2, byteorder='big') + b"".join(
+                did.to_bytes(2, byteorder='big') + bytes([position, size]) for did, position, size in sources[i:i + per_request])
+            response = self._request(target, request)
+            if not response.startswith(b"\x6C"):
+                raise ValueError("Failed to define dynamic identifier", response.hex())
+        self._dynamic[key] = sources
+
+    def dynamic_size(self, target: bytes | int, dynamic_id: int) -> int | None:
+        # Bytes in a DID defined through define_dynamic_identifier, None if it wasn't
+        sources = self._dynamic.get((_target_key(target), dynamic_id))
+        return sum(size for _, _, size in sources) if sources is not None else None
+
+    def clear_dynamic_identifier(self, target: bytes | int, dynamic_id: int | None = None):
+        # 0x2C clearDynamicallyDefinedDataIdentifier, all of them if no DID is given
+        request = b"\x2C\x03" + (dynamic_id.to_bytes(2, byteorder='big') if dynamic_id is not None else b"")
+        response = self._request(target, request)
+        # Clearing one that isn't defined may come back as requestOutOfRange, which is fine
+        if not response.startswith(b"\x6C") and response[:3] != b"\x7F\x2C\x31":
+            raise ValueError("Failed to clear dynamic identifier", response.hex())
+        if dynamic_id is None:
+            for key in [k for k in self._dynamic if k[0] == _target_key(target)]:
+                del self._dynamic[key]
+        else:
+            self._dynamic.pop((_target_key(target), dynamic_id), None)
+
+    def read_data_by_periodic_identifier(self, target: bytes | int, identifiers: list, rate: int):
+        # Starts periodic transmission of 0xF2xx DIDs at rate 0x01 (slow), 0x02 (medium) or 0x03 (fast).
+        # The ECU then sends each one unsolicited, see periodic.PeriodicStream.
+        response = self._request(target, bytes([0x2A, rate]) + bytes(_periodic_id(i) for i in identifiers))
+        if not response.startswith(b"\x6A"):
+            raise ValueError("Failed to start periodic transmission", response.hex())
+
+    def stop_periodic(self, target: bytes | int, identifiers: list = ()):
+        # 0x04 stopSending, for the given DIDs or all of them
+        response = self._request(target, b"\x2A\x04" + bytes(_periodic_id(i) for i in identifiers))
+        if not response.startswith(b"\x6A"):
+            raise ValueError("Failed to stop periodic transmission", response.hex())
+
+    def read_memory_by_address(self, target: bytes | int, address: int, size: int,
+                               address_length: int = 4, size_length: int = 4) -> bytes:
+        # 0x23 with addressAndLengthFormatIdentifier = size length << 4 | address length
+        request = (bytes([0x23, size_length << 4 | address_length]) + address.to_bytes(address_length, byteorder='big')
+                   + size.to_bytes(size_length, byteorder='big'))
+        response = self._request(target, request)
+        if not response.startswith(b"\x63"):
+            raise ValueError("Failed to read memory by address", response.hex())
+        return response[1:]
+
     def tester_present(self, target: bytes | int) -> bool:
         try:
-            response = self.adapter.write_obd(target, b"\x3E\x00")
+            response = self._request(target, b"\x3E\x00")
         except CANError:
             return False
         if response.startswith(b"\x7E"):
@@ -143,29 +777,93 @@ class UDS:
                 return False
             time.sleep(0.1)
 
-    def read_dtcs(self, target: bytes | int, status_mask: int = 0xFF) -> list:
-        # TODO: Use status mask in request
-        response = self.adapter.write_obd(target, b"\x19\x02\xFF")
-        if response[0] == 0x59:
-            print(f"Raw DTC response: {response.hex().upper()}")
-            # Byte 1 is subfunction echoed back, byte 2 is the DTC status availability mask count
-            dtcs = []
-            payload = response[3:]
-
-            dtcs = []
-            for i in range(0, len(payload), 4):
-                if i + 3 >= len(payload):
-                    break
-                b1, b2, ftb, status = payload[i:i+4]
-                if status & status_mask == 0:
-                    continue  # Skip DTCs that do not match the status mask
+    def start_keepalive(self, target: bytes | int, interval: float = 2.0):
+        # Sends 3E 80 in the background whenever nothing else has reached the target for `interval`
+        # seconds. Runs on the adapter's event loop so it queues up behind in-flight commands.
+        aio = self.adapter._async or self.adapter.start_background()
+        self.stop_keepalive(target)
+        coro = self._keepalive(aio, target, interval)
+        if aio._thread is None:
+            task = aio.loop.create_task(coro)  # Caller owns the loop (and is running in it)
+        else:
+            task = asyncio.run_coroutine_threadsafe(coro, aio.loop)
+        self._keepalives[_target_key(target)] = task
 
-                dtc_num = f"{b1:02X}{b2:02X}{ftb:02X}"  # e.g., "F00004"
-                dtcs.append(dtc_num)
+    def stop_keepalive(self, target: bytes | int | None = None):
+        # Raises whatever ended a keepalive early, once they've all been stopped
+        keys = list(self._keepalives) if target is None else [_target_key(target)]
+        error = None
+        for key in keys:
+            task = self._keepalives.pop(key, None)
+            if task is not None:
+                task.cancel()
+                error = error or _failure(task)
+        if error is not None:
+            raise error
 
-            return dtcs
-        else:
+    def _check_keepalive(self, key: int):
+        # A keepalive that died means the session may already have dropped back to default
+        task = self._keepalives.get(key)
+        error = _failure(task) if task is not None else None
+        if error is not None:
+            del self._keepalives[key]
+            raise error
+
+    async def _keepalive(self, aio, target: bytes | int, interval: float):
+        key = _target_key(target)
+        failures = 0
+        while True:
+            idle = time.monotonic() - self._last_activity.get(key, 0)
+            if idle < interval:
+                # Other traffic is keeping the session alive
+                await asyncio.sleep(interval - idle)
+                continue
+            try:
+                await aio.send_obd(target, b"\x3E\x80")
+            except CANError:
+                pass
+            except (serial.SerialException, AssertionError) as e:
+                # Adapter trouble (AdapterTimeout included) may clear up, keep trying but back off
+                failures += 1
+                log.warning("Keepalive to %X failed (%s), retry %d", key, e, failures)
+                await asyncio.sleep(min(interval, 0.1 * 2 ** failures))
+                continue
+            failures = 0
+            self._last_activity[key] = time.monotonic()
+
+    def read_dtc_records(self, target: bytes | int, status_mask: int = 0xFF) -> list:
+        # 19 02 reportDTCByStatusMask, the ECU does the filtering
+        response = self._request(target, bytes([0x19, 0x02, status_mask]))
+        if not response.startswith(b"\x59\x02"):
             raise ValueError("Failed to read DTCs", response.hex())
+        # Byte 2 is the ECU's DTC status availability mask
+        return [r for r in parse_dtc_records(response[3:]) if r.status & status_mask]
+
+    def read_dtcs(self, target: bytes | int, status_mask: int = 0xFF) -> list:
+        # DTC numbers as hex strings, e.g. "F00004"
+        return [r.code for r in self.read_dtc_records(target, status_mask)]
+
+    def read_dtc_snapshot(self, target: bytes | int, dtc: int, record: int = 0xFF) -> bytes:
+        # 19 04 reportDTCSnapshotRecordByDTCNumber, all records by default. Returns what follows the
+        # DTC and its status: (record number, DID count, (DID, data)...)... see decode.DTCDataDecoder
+        response = self._request(target, bytes([0x19, 0x04]) + dtc.to_bytes(3, byteorder='big') + bytes([record]))
+        if not response.startswith(b"\x59\x04") or len(response) < 6:
+            raise ValueError("Failed to read DTC snapshot", response.hex())
+        return response[6:]
+
+    def read_dtc_extended_data(self, target: bytes | int, dtc: int, record: int = 0xFF) -> bytes:
+        # 19 06 reportDTCExtDataRecordByDTCNumber, returns (record number, data)... as above
+        response = self._request(target, bytes([0x19, 0x06]) + dtc.to_bytes(3, byteorder='big') + bytes([record]))
+        if not response.startswith(b"\x59\x06") or len(response) < 6:
+            raise ValueError("Failed to read DTC extended data", response.hex())
+        return response[6:]
+
+    def count_dtcs(self, target: bytes | int, status_mask: int = 0xFF) -> int:
+        # 19 01 reportNumberOfDTCByStatusMask: 59 01 <availability mask> <format> <count (2 bytes)>
+        response = self._request(target, bytes([0x19, 0x01, status_mask]))
+        if not response.startswith(b"\x59\x01") or len(response) < 6:
+            raise ValueError("Failed to count DTCs", response.hex())
+        return int.from_bytes(response[4:6], byteorder='big')
 
 def interactive(port):
     elm = OBDLink(port)
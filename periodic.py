@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import deque, namedtuple
+from mdx import did_sizes
+from dynamic import CompositeDID
+
+PeriodicSample = namedtuple("PeriodicSample", ["time", "did", "data"])
+
+# 0x2A transmission modes, the actual periods are up to the ECU
+SLOW = 0x01
+MEDIUM = 0x02
+FAST = 0x03
+
+# 0x2A only takes these, the low byte goes in the request and leads each periodic frame
+PERIODIC_DID_BASE = 0xF200
+
+class PeriodicStream:
+    """
+    ReadDataByPeriodicIdentifier (0x2A) consumer. Asks the ECU to push the given 0xF2xx DIDs,
+    puts the adapter in monitor mode on the ECU's response ID and collects every frame into a
+    bounded ring buffer of timestamped samples. When the buffer is full the oldest samples are
+    dropped (and counted), so a slow consumer never stalls the reader.
+
+        with PeriodicStream(diag, 0x716, [0xF201], FAST, sizes={0xF201: 2}) as stream:
+            for sample in stream:
+                ...
+
+    Periodic frames are single frames carrying the low byte of the DID followed by its data.
+    The adapter can't send anything while it's monitoring, so stop any keepalive first.
+
+    Samples are cut to each DID's size so the frame padding doesn't end up in them: `sizes` if
+    given, else the dynamic definition made through the UDS, else the MDX (`parsed_data`).
+    Ordinary DIDs go through stream_signals().
+    """
+
+    def __init__(self, diag, target: bytes | int, identifiers: list, rate: int = FAST,
+                 sizes: dict | None = None, response_id: int | None = None, maxlen: int = 4096,
+                 parsed_data=None):
+        self.diag = diag
+        self.target = target
+        self.identifiers = list(identifiers)
+        self.rate = rate
+        self.sizes = dict(sizes or {})
+        self.composites = {}  # Periodic DID -> CompositeDID defined there on start()
+        self._mdx_sizes = did_sizes(parsed_data) if parsed_data is not None else {}
+        target_id = int.from_bytes(target, byteorder='big') if isinstance(target, bytes) else target
+        self.response_id = response_id if response_id is not None else target_id + 8
+        self.samples = deque(maxlen=maxlen)
+        self.latest = {}  # DID -> most recent sample
+        self.received = 0
+        self.dropped = 0
+        self._by_pid = {i & 0xFF: i for i in self.identifiers}
+        self._cv = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._ready = threading.Event()  # Set once the adapter is monitoring (or gave up trying)
+
+    def start(self):
+        for composite in self.composites.values():
+            composite.define(self.diag, self.target)
+        for identifier in self.identifiers:
+            if identifier not in self.sizes:
+                size = self.diag.dynamic_size(self.target, identifier) or self._mdx_sizes.get(identifier)
+                if size is not None:
+                    self.sizes[identifier] = size
+        self.diag.read_data_by_periodic_identifier(self.target, self.identifiers, self.rate)
+        self._running = True
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="periodic-monitor", daemon=True)
+        self._thread.start()
+        # stop_monitor() does nothing until ATMA has gone out, so stop() mustn't get in before that
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        thread, self._thread = self._thread, None
+        self.diag.adapter.stop_monitor()
+        # Leaving monitor mode takes a few adapter commands, each bounded by command_timeout
+        thread.join(4 * self.diag.adapter.command_timeout)
+        with self._cv:
+            self._running = False
+            self._cv.notify_all()
+        if thread.is_alive():
+            raise RuntimeError("Adapter didn't leave monitor mode, periodic transmission is still on")
+        self.diag.stop_periodic(self.target, self.identifiers)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        try:
+            for frame in self.diag.adapter.monitor(self.response_id, self._ready):
+                now = time.monotonic()
+                if not frame or frame[0] not in self._by_pid:
+                    continue
+                identifier = self._by_pid[frame[0]]
+                size = self.sizes.get(identifier)
+                sample = PeriodicSample(now, identifier, frame[1:1 + size] if size else frame[1:])
+                with self._cv:
+                    if len(self.samples) == self.samples.maxlen:
+                        self.dropped += 1
+                    self.samples.append(sample)
+                    self.latest[identifier] = sample
+                    self.received += 1
+                    self._cv.notify_all()
+        finally:
+            self._ready.set()
+            with self._cv:
+                self._running = False
+                self._cv.notify_all()
+
+    def decode(self, sample: PeriodicSample) -> dict:
+        # {source DID: [DecodedField, ...]} for a sample of a stream_signals() composite
+        return self.composites[sample.did].decode(sample.data)
+
+    def get(self, timeout: float | None = None) -> PeriodicSample | None:
+        # Oldest buffered sample, waiting up to `timeout` for one. None on timeout or once stopped.
+        with self._cv:
+            self._cv.wait_for(lambda: self.samples or not self._running, timeout)
+            return self.samples.popleft() if self.samples else None
+
+    def drain(self) -> list:
+        with self._cv:
+            out = list(self.samples)
+            self.samples.clear()
+            return out
+
+    def __iter__(self):
+        # Blocks for each sample, ends when the stream is stopped and the buffer is empty
+        while True:
+            sample = self.get()
+            if sample is None:
+                return
+            yield sample
+
+def stream_signals(diag, target: bytes | int, parsed_data, signals: list, rate: int = FAST,
+                   periodic_id: int = PERIODIC_DID_BASE, **kwargs) -> PeriodicStream:
+    """
+    Streams ordinary DIDs (or SUB_FIELDs of them, as in dynamic.CompositeDID) with 0x2A. Only
+    0xF2xx DIDs can be periodic, so the signals are packed into a dynamically defined DID at
+    `periodic_id`, which has to fit one frame (7 bytes).
+
+        with stream_signals(diag, 0x716, parsed, [0xD111]) as stream:
+            for sample in stream:
+                print(stream.decode(sample)[0xD111])
+    """
+    composite = CompositeDID(parsed_data, signals, periodic_id)
+    if composite.size > 7:
+        raise ValueError(f"Signals take {composite.size} bytes, a periodic frame carries 7")
+    stream = PeriodicStream(diag, target, [periodic_id], rate, parsed_data=parsed_data, **kwargs)
+    stream.composites[periodic_id] = composite
+    return stream
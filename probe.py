@@ -1,69 +1,110 @@
 import sys
 import time
 from obdlink import *
-from mdx import parse_mdx, interpret_dtc  # Your earlier parsing code
+from mdx import load_mdx, did_sizes, accessible_dids  # Your earlier parsing code
+from decode import compile_decoders, format_fields, DTCDataDecoder
+from dtc import read_dtc_details
+from timing import LatencyStats
+from capability import CapabilityCache, read_part_number, group_by_requirement
 
-def probe_using_mdx(diag: UDS, mdx_path, ecu_addr=0x716):
-    # Parse MDX to get DID definitions
-    parsed = parse_mdx(mdx_path)
+def probe_using_mdx(diag: UDS, mdx_path, ecu_addr=0x716, session_ref='session_01', relearn=False,
+                    parsed=None, emit=print):
+    # Parse MDX to get DID definitions, unless the caller already has them (e.g. shared between scans)
+    if parsed is None:
+        parsed = load_mdx(mdx_path)
+    decoders = compile_decoders(parsed)
+    stats = LatencyStats()
+    diag.adapter.hooks.append(stats)
+    try:
+        # Multi-frame limits and timing from the ECU's NETWORK_LAYER, plain ELM327s need it for long DIDs
+        diag.adapter.configure_isotp(parsed["protocol"]["network"])
+        # Response timeouts learned per ECU, never longer than its P2 allows
+        diag.adapter.configure_timing(parsed["protocol"]["timing"], parsed["protocol"]["network"].get("delta_p2"))
 
 
 
-    print(f"Waiting for ECU {hex(ecu_addr)}...")
-    diag.wait_for_tester_present(ecu_addr, timeout=10)
-    print(f"Connected to ECU {hex(ecu_addr)}\n")
+        emit(f"Waiting for ECU {hex(ecu_addr)}...")
+        diag.wait_for_tester_present(ecu_addr, timeout=10)
+        emit(f"Connected to ECU {hex(ecu_addr)}\n")
 
-    print("===== Reading All DIDs from MDX =====")
-    for did_num, did_info in parsed["dids"].items():
+        emit("===== Reading All DIDs from MDX =====")
+        # Only ask for DIDs the MDX says are readable with 0x22 in this session, the rest can only fail
+        readable = accessible_dids(parsed, session_ref, "service_22", "READABLE")
+        # ...and skip the ones this software revision refused on an earlier run
+        part_number = read_part_number(diag, ecu_addr)
+        caps = CapabilityCache(ecu_addr, part_number) if part_number else None
+        if caps and relearn:
+            caps.forget(session_ref)
+        known = caps.unsupported(session_ref) if caps else {}
+        dids = {int(did_num, 16): did_num for did_num in parsed["dids"]
+                if did_num and int(did_num, 16) in readable and int(did_num, 16) not in known}
+        if known:
+            emit(f"Skipping {len(known)} DIDs that {hex(ecu_addr)} ({part_number}) refused before:")
+            for label, group in group_by_requirement(parsed["access_index"], known, session_ref).items():
+                emit(f"  {label}: {' '.join(f'0x{d:04X}' for d in group)}")
+        errors = {}
         try:
-            # Try to interpret DID as hex
-            if did_num.startswith("0x") or did_num.startswith("0X"):
-                did_val = int(did_num, 16)
-            else:
-                did_val = int(did_num, 16) if did_num else None
-            if did_val is None:
-                continue
-
-            # Read from ECU
-            raw = diag.read_data_by_identifier(ecu_addr, did_val)
-            try:
-                # Attempt to decode as UTF-8 string, strip NULs
-                decoded = raw.decode("ascii", errors="strict").rstrip("\x00")
-                # Check for empty string
-                if not decoded:
-                    raise ValueError("Empty string after decoding")
-                # Check for nonprintable characters
-                if not all(c.isprintable() or c.isspace() for c in decoded):
-                    raise ValueError("Non-printable characters found")
-                print(f"{did_num} ({did_info['name']}): {decoded}")
-            except Exception:
-                # Fall back to b''
-                print(f"{did_num} ({did_info['name']}): {raw}")
+            # Read from ECU, several DIDs per request
+            values = diag.read_data_by_identifiers(ecu_addr, list(dids), did_sizes(parsed),
+                                                   parsed["protocol"]["max_dids_per_request"], errors)
         except Exception as e:
-            print(f"{did_num} ({did_info['name']}): ERROR - {e}")
+            emit(f"ERROR - {e}")
+            values = {}
+        # Counted from what came back, refusals remembered from earlier runs are listed above
+        emit(f"{len(values)} of {len(parsed['dids'])} DIDs readable in {session_ref}")
+        if caps:
+            caps.record(session_ref, errors)
+            caps.save()
+        for did_val, did_num in dids.items():
+            did_info = parsed["dids"][did_num]
+            if did_val not in values:
+                nrc = errors.get(did_val)
+                reason = f"negative response 0x{nrc:02X}" if nrc is not None else "no positive response"
+                emit(f"{did_num} ({did_info['name']}): ERROR - {reason}")
+                continue
+            raw = values[did_val]
+            decoder = decoders.get(did_val)
+            if decoder is not None and decoder.fields:
+                emit(f"{did_num} ({did_info['name']}): {format_fields(decoder.decode(raw))}")
+            else:
+                emit(f"{did_num} ({did_info['name']}): {raw}")
 
-    print("\n===== Reading and Interpreting DTCs =====")
-    try:
-        dtcs = diag.read_dtcs(ecu_addr)
-        if not dtcs:
-            print("No stored DTCs")
-        else:
-            for code in dtcs:
-                dtc_info = interpret_dtc(parsed, code)
-                if dtc_info:
-                    print(f"{code} - {dtc_info['base_description']}: {dtc_info['failure_description']}")
+        emit("\n===== Reading and Interpreting DTCs =====")
+        try:
+            # One pass: each DTC comes with its snapshots and extended data, decoded via the MDX
+            details = read_dtc_details(diag, ecu_addr, parsed, decoder=DTCDataDecoder(parsed, decoders))
+            if not details:
+                emit("No stored DTCs")
+            for dtc in details:
+                code = dtc.record.code
+                if dtc.info:
+                    emit(f"{code} - {dtc.info['base_description']}: {dtc.info['failure_description']}")
                 else:
-                    print(f"{code} - (Unknown DTC)")
-    except Exception as e:
-        print("Error reading DTCs:", e)
+                    emit(f"{code} - (Unknown DTC)")
+                emit(f"  status: {', '.join(dtc.record.status_bits) or 'none'}")
+                for snapshot in dtc.snapshots:
+                    for did_val, fields in snapshot.values.items():
+                        value = format_fields(fields) if isinstance(fields, list) else fields.hex().upper()
+                        emit(f"  snapshot 0x{snapshot.record:02X} 0x{did_val:04X}: {value}")
+                for record, fields in dtc.extended.items():
+                    value = format_fields(fields) if isinstance(fields, list) else fields.hex().upper()
+                    emit(f"  extended 0x{record:02X}: {value}")
+        except Exception as e:
+            emit(f"Error reading DTCs: {e}")
+    finally:
+        diag.adapter.hooks.remove(stats)
+    emit("\n===== Command Timing =====")
+    emit(stats.report())
+    return values
 
 if __name__ == "__main__":
     from serial.tools import list_ports
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <path_to_mdx>")
+        print(f"Usage: {sys.argv[0]} <path_to_mdx> [--idle] [--relearn]")
         sys.exit(1)
     mdx_path = sys.argv[1]
     idle_flag = "--idle" in sys.argv
+    relearn = "--relearn" in sys.argv
 
     ports = list_ports.comports()
     if not ports:
@@ -87,12 +128,13 @@ if __name__ == "__main__":
     elm.defaults()
     diag = UDS(elm)
 
-    probe_using_mdx(diag, mdx_path)
+    probe_using_mdx(diag, mdx_path, relearn=relearn)
     if idle_flag:
         print("Keeping the connection alive. Press Ctrl+C to exit.")
+        diag.start_keepalive(0x716)
         try:
             while True:
-                diag.tester_present(0x716)
                 time.sleep(1)
         except KeyboardInterrupt:
-            print("Exiting...")
\ No newline at end of file
+            print("Exiting...")
+        diag.stop_keepalive()
\ No newline at end of file
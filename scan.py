@@ -0,0 +1,76 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from obdlink import OBDLink, UDS
+from mdx import load_mdx
+from probe import probe_using_mdx
+
+class LineWriter:
+    """Serialises output from several scans into one stream, each line tagged with its adapter."""
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self._lock = threading.Lock()
+
+    def emitter(self, tag: str):
+        def emit(text=""):
+            lines = "".join(f"[{tag}] {line}\n" for line in str(text).split("\n"))
+            with self._lock:
+                self.out.write(lines)
+                self.out.flush()
+        return emit
+
+def open_obdlink(port: str) -> OBDLink:
+    elm = OBDLink(port)
+    elm.connect()
+    elm.defaults()
+    return elm
+
+def scan_one(port, parsed, emit, ecu_addr=0x716, session_ref='session_01', open_adapter=open_obdlink) -> dict:
+    start = time.monotonic()
+    elm = open_adapter(port)
+    try:
+        emit(f"Adapter: {elm.device_id()} at {elm.baud} baud")
+        values = probe_using_mdx(UDS(elm), None, ecu_addr, session_ref, parsed=parsed, emit=emit)
+    finally:
+        elm.disconnect()
+    return {"port": port, "dids": len(values), "seconds": time.monotonic() - start}
+
+def scan_all(ports: list, mdx_path=None, parsed=None, ecu_addr=0x716, session_ref='session_01',
+             out=None, open_adapter=open_obdlink) -> list:
+    # One thread per adapter: the work is serial I/O, so threads scale and can all share one parsed MDX
+    if parsed is None:
+        parsed = load_mdx(mdx_path)
+    writer = LineWriter(out)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(len(ports), 1), thread_name_prefix="scan") as pool:
+        futures = {pool.submit(scan_one, port, parsed, writer.emitter(str(port)), ecu_addr, session_ref,
+                               open_adapter): port for port in ports}
+        for future in as_completed(futures):
+            port = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                writer.emitter(str(port))(f"SCAN FAILED - {e!r}")
+                results.append({"port": port, "error": repr(e)})
+    return results
+
+if __name__ == "__main__":
+    from serial.tools import list_ports
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <path_to_mdx> [port ...]")
+        sys.exit(1)
+    ports = sys.argv[2:] or [p.device for p in list_ports.comports()]
+    if not ports:
+        print("No serial ports found.")
+        sys.exit(1)
+
+    start = time.monotonic()
+    results = scan_all(ports, sys.argv[1])
+    print(f"\n===== Scanned {len(ports)} adapters in {time.monotonic() - start:.1f}s =====")
+    for r in sorted(results, key=lambda r: str(r["port"])):
+        if "error" in r:
+            print(f"{r['port']}: FAILED - {r['error']}")
+        else:
+            print(f"{r['port']}: {r['dids']} DIDs in {r['seconds']:.1f}s")
@@ -0,0 +1,670 @@
+import json
+import threading
+import time
+from mdx import did_sizes
+from isotp import (ISOTPError, Reassembler, network_parameters, segment, pad, flow_control, parse_flow_control,
+                   FIRST_FRAME, FLOW_CONTROL, CONTINUE_TO_SEND, OVERFLOW)
+
+class ReplayError(Exception):
+    """Raised when traffic sent to a ReplayTransport doesn't match the recording."""
+    pass
+
+class SerialBuffer:
+    """
+    Receive side of a serial.Serial stand-in: a thread-safe byte buffer with pyserial's
+    read/read_until/in_waiting/timeout semantics. Subclasses decide what write() does.
+    """
+
+    def __init__(self):
+        self.timeout = None
+        self.is_open = True
+        self._rx = bytearray()
+        self._cv = threading.Condition()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx)
+
+    def feed(self, data: bytes):
+        with self._cv:
+            self._rx += data
+            self._cv.notify_all()
+
+    def _wait(self, ready) -> bool:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not ready():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._cv.wait(remaining)
+        return True
+
+    def read(self, size: int = 1) -> bytes:
+        with self._cv:
+            self._wait(lambda: len(self._rx) >= size)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def read_until(self, expected: bytes = b"\n", size: int | None = None) -> bytes:
+        with self._cv:
+            def ready():
+                return expected in self._rx or (size is not None and len(self._rx) >= size)
+            self._wait(ready)
+            end = self._rx.find(expected)
+            end = len(self._rx) if end < 0 else end + len(expected)
+            if size is not None:
+                end = min(end, size)
+            data = bytes(self._rx[:end])
+            del self._rx[:end]
+            return data
+
+    def reset_input_buffer(self):
+        with self._cv:
+            self._rx.clear()
+
+    def close(self):
+        self.is_open = False
+
+# Seconds between periodic (0x2A) frames for the slow, medium and fast transmission modes
+PERIODIC_PERIODS = {0x01: 1.0, 0x02: 0.1, 0x03: 0.01}
+
+class SimulatedECU:
+    """UDS server answering from the MDX: DID sizes, per-session readability, DTC list, 0x22 batching limit."""
+
+    def __init__(self, parsed_data, values: dict | None = None, dtcs: dict | None = None, refused: dict | None = None,
+                 busy: dict | None = None):
+        self.sizes = did_sizes(parsed_data)
+        self.access_index = parsed_data["access_index"]
+        self.max_dids = parsed_data["protocol"]["max_dids_per_request"]
+        self.supported_dtcs = [int(code, 16) for code in parsed_data["dtcs"] if len(code) == 6]
+        self.dtc_index = parsed_data["dtc_index"]
+        self.extended_sizes = {number: int(info["byte_size"] or 0)
+                               for number, info in parsed_data["extended_records"].items()}
+        self.values = dict(values or {})
+        # Stored DTCs as {code: status byte}, codes may be given as "C02809" or 0xC02809
+        self.dtcs = {int(code, 16) if isinstance(code, str) else code: status
+                     for code, status in (dtcs or {}).items()}
+        # {DID: NRC} for MDX entries this software revision doesn't actually serve
+        self.refused = dict(refused or {})
+        # {DID: seconds} for reads that take longer than P2, answered with response pending (7F 22 78)
+        # until that long after the request first arrived
+        self.busy = dict(busy or {})
+        self._working = {}  # request -> time.monotonic() its real answer is due
+        self.network = network_parameters(parsed_data["protocol"].get("network"))
+        self.memory_areas = [(a["start"], a["size"]) for a in parsed_data["memory_areas"]]
+        self._memory = {}  # Area start -> contents, built on first read
+        self.periodic = {}  # DID -> 0x2A transmission mode
+        self.dynamic = {}   # Dynamically defined DID -> [(source DID, position, size)]
+        self.session = 0x01
+
+    def value(self, identifier: int) -> bytes:
+        if identifier in self.dynamic:
+            return b"".join(self.value(source)[position - 1:position - 1 + size]
+                            for source, position, size in self.dynamic[identifier])
+        if identifier in self.values:
+            return self.values[identifier]
+        # Deterministic filler so repeated runs see the same data
+        return bytes((identifier + i) & 0xFF for i in range(self.sizes[identifier]))
+
+    def handle(self, request: bytes) -> bytes | None:
+        # None means the ECU stays silent
+        sid = request[0]
+        if sid == 0x10 and len(request) == 2:
+            if request[1] & 0x7F != self.session:
+                self.dynamic.clear()  # Dynamic definitions don't survive a session change
+            self.session = request[1] & 0x7F
+            return None if request[1] & 0x80 else bytes([0x50, self.session, 0x00, 0x32, 0x01, 0xF4])
+        if sid == 0x3E and len(request) == 2:
+            return None if request[1] & 0x80 else b"\x7E\x00"
+        if sid == 0x22:
+            if self._still_working(request):
+                return bytes([0x7F, sid, 0x78])
+            return self._read_data_by_identifier(request)
+        if sid == 0x19 and len(request) >= 2:
+            return self._read_dtc_information(request)
+        if sid == 0x2C and len(request) >= 2:
+            return self._dynamically_define_data_identifier(request)
+        if sid == 0x2A and len(request) >= 2:
+            return self._read_data_by_periodic_identifier(request)
+        if sid == 0x23 and len(request) >= 2:
+            return self._read_memory_by_address(request)
+        if sid == 0x14:
+            self.dtcs.clear()
+            return b"\x54"
+        return bytes([0x7F, sid, 0x11])
+
+    def _still_working(self, request: bytes) -> bool:
+        delay = max((self.busy.get(int.from_bytes(request[i:i+2], "big"), 0) for i in range(1, len(request) - 1, 2)),
+                    default=0)
+        if not delay:
+            return False
+        # A repeated request while the first is in progress doesn't start it over
+        if time.monotonic() < self._working.setdefault(request, time.monotonic() + delay):
+            return True
+        del self._working[request]
+        return False
+
+    def pending_for(self, request: bytes) -> float:
+        # Seconds until a request that got response pending has its real answer
+        due = self._working.get(request)
+        return max(0.0, due - time.monotonic()) if due is not None else 0.0
+
+    def _read_data_by_identifier(self, request: bytes) -> bytes:
+        if len(request) < 3 or len(request) % 2 == 0:
+            return b"\x7F\x22\x13"
+        identifiers = [int.from_bytes(request[i:i+2], "big") for i in range(1, len(request), 2)]
+        if self.max_dids and len(identifiers) > self.max_dids:
+            return b"\x7F\x22\x13"
+        readable = self.access_index.get((f"session_{self.session:02X}", "service_22", "READABLE"), frozenset())
+        for identifier in identifiers:
+            # Anything but requestOutOfRange (e.g. securityAccessDenied) fails the whole request
+            if self.refused.get(identifier, 0x31) != 0x31:
+                return bytes([0x7F, 0x22, self.refused[identifier]])
+        out = bytearray(b"\x62")
+        for identifier in identifiers:
+            if (identifier in readable or identifier in self.dynamic) and identifier not in self.refused:
+                out += identifier.to_bytes(2, "big") + self.value(identifier)
+        if len(out) == 1:
+            return b"\x7F\x22\x31"
+        return bytes(out)
+
+    def _dynamically_define_data_identifier(self, request: bytes) -> bytes:
+        sub = request[1]
+        if sub == 0x03 and len(request) in (2, 4):
+            if len(request) == 2:
+                self.dynamic.clear()
+            else:
+                self.dynamic.pop(int.from_bytes(request[2:4], "big"), None)
+            return b"\x6C" + request[1:]
+        if sub != 0x01 or len(request) < 8 or (len(request) - 4) % 4:
+            return b"\x7F\x2C\x13"
+        dynamic_id = int.from_bytes(request[2:4], "big")
+        if not 0xF200 <= dynamic_id <= 0xF3FF:
+            return b"\x7F\x2C\x31"
+        readable = self.access_index.get((f"session_{self.session:02X}", "service_22", "READABLE"), frozenset())
+        sources = []
+        for i in range(4, len(request), 4):
+            source = int.from_bytes(request[i:i+2], "big")
+            position, size = request[i+2], request[i+3]
+            if source not in readable or position < 1 or position - 1 + size > self.sizes.get(source, 0):
+                return b"\x7F\x2C\x31"
+            sources.append((source, position, size))
+        # Repeated definitions append to the existing one
+        self.dynamic.setdefault(dynamic_id, []).extend(sources)
+        return b"\x6C\x01" + request[2:4]
+
+    def memory(self, start: int) -> bytes:
+        # Deterministic contents for the memory area starting at `start`
+        if start not in self._memory:
+            size = dict(self.memory_areas)[start]
+            pattern = bytes((start >> 8 ^ i * 7) & 0xFF for i in range(256))
+            self._memory[start] = (pattern * (size // 256 + 1))[:size]
+        return self._memory[start]
+
+    def _read_memory_by_address(self, request: bytes) -> bytes:
+        address_length, size_length = request[1] & 0x0F, request[1] >> 4
+        if not address_length or not size_length or len(request) != 2 + address_length + size_length:
+            return b"\x7F\x23\x13"
+        address = int.from_bytes(request[2:2 + address_length], "big")
+        size = int.from_bytes(request[2 + address_length:], "big")
+        if not size or 1 + size > self.network.max_msg_size:
+            return b"\x7F\x23\x31"
+        for start, area_size in self.memory_areas:
+            if start <= address and address + size <= start + area_size:
+                return b"\x63" + self.memory(start)[address - start:address - start + size]
+        return b"\x7F\x23\x31"
+
+    def _read_data_by_periodic_identifier(self, request: bytes) -> bytes:
+        mode = request[1]
+        identifiers = [0xF200 | pid for pid in request[2:]]
+        if mode == 0x04:
+            for identifier in identifiers or list(self.periodic):
+                self.periodic.pop(identifier, None)
+            return b"\x6A"
+        if mode not in PERIODIC_PERIODS or not identifiers:
+            return b"\x7F\x2A\x31"
+        for identifier in identifiers:
+            if identifier not in self.values and identifier not in self.sizes and identifier not in self.dynamic:
+                return b"\x7F\x2A\x31"
+            if len(self.value(identifier)) > 7:
+                return b"\x7F\x2A\x13"  # Doesn't fit a single frame
+        for identifier in identifiers:
+            self.periodic[identifier] = mode
+        return b"\x6A"
+
+    def _read_dtc_information(self, request: bytes) -> bytes:
+        sub = request[1]
+        if sub in (0x01, 0x02) and len(request) == 3:
+            mask = request[2]
+            matching = [(code, status) for code, status in self.dtcs.items() if status & mask]
+            if sub == 0x01:
+                return bytes([0x59, 0x01, 0xFF, 0x00]) + len(matching).to_bytes(2, "big")
+            return bytes([0x59, 0x02, 0xFF]) + b"".join(code.to_bytes(3, "big") + bytes([status])
+                                                        for code, status in matching)
+        if sub in (0x04, 0x06) and len(request) == 6:
+            dtc, record = int.from_bytes(request[2:5], "big"), request[5]
+            info = self.dtc_index.get(dtc)
+            if dtc not in self.dtcs or info is None:
+                return b"\x7F\x19\x31"
+            out = bytearray([0x59, sub]) + request[2:5] + bytes([self.dtcs[dtc]])
+            if sub == 0x04:
+                for number, dids in info["snapshots"].items():
+                    if record in (0xFF, number):
+                        out += bytes([number, len(dids)])
+                        for identifier in dids:
+                            out += identifier.to_bytes(2, "big") + self.value(identifier)
+            else:
+                for number in info["extended_records"]:
+                    if record in (0xFF, number):
+                        out += bytes([number]) + bytes([(dtc + number) & 0xFF]) * self.extended_sizes[number]
+            return bytes(out)
+        if sub == 0x0A and len(request) == 2:
+            return bytes([0x59, 0x0A, 0xFF]) + b"".join(code.to_bytes(3, "big") + bytes([self.dtcs.get(code, 0)])
+                                                        for code in self.supported_dtcs)
+        return bytes([0x7F, 0x19, 0x12])
+
+class SimulatedAdapter(SerialBuffer):
+    """
+    Emulates an ELM327 (or an STN-based OBDLink with stn=True) on the other end of the port:
+    echo, AT/ST settings, ATSH + hex requests and STPX, answering from SimulatedECUs keyed by
+    request CAN ID. `latency` is added to every request that goes out on the bus.
+
+    With ATCAF0 each hex line is a raw CAN frame and the ECU side does ISO-TP itself, answering
+    first frames with flow control per its MDX NETWORK_LAYER and holding its own consecutive
+    frames until the tester's flow control arrives.
+
+    With timeouts=True a request nothing answers (or that takes longer than `latency` allows)
+    costs the response timeout (ATST, or STPX's t:) before NO DATA, like the real thing.
+    `baudrate` is the host's side of the UART, STBR switches are accepted up to max_baud and
+    anything sent at the wrong rate comes back garbled.
+    """
+
+    def __init__(self, ecus: dict, stn: bool = True, latency: float = 0.0, voltage: float = 12.6,
+                 timeouts: bool = False, max_baud: int = 2000000):
+        super().__init__()
+        self.ecus = ecus
+        self.stn = stn
+        self.latency = latency
+        self.voltage = voltage
+        self.timeouts = timeouts
+        self.max_baud = max_baud
+        self.baudrate = 115200
+        self.response_timeout = 0.2  # ATST, 0x32 * 4ms after a reset
+        self._uart = 115200
+        self._switch = None  # Timer reverting an STBR switch the host hasn't confirmed
+        self.echo = True
+        self.spaces = True
+        self.segmentation = False
+        self.header = 0x7DF
+        self.receive_filter = None
+        self.auto_format = True
+        self.responses = True
+        self._requests = {}  # header -> Reassembler for a request arriving as raw frames
+        self._pending = {}   # header -> consecutive frames waiting for the tester's flow control
+        self._block = {}     # header -> consecutive frames received since the last flow control
+        self._line = bytearray()
+        self._monitor = None
+
+    def write(self, data: bytes) -> int:
+        if self._switch is not None:
+            self._confirm_baud(data)
+            return len(data)
+        if self.baudrate != self._uart:
+            self.feed(bytes(b ^ 0x5A for b in data))  # Wrong rate, the adapter sees noise
+            return len(data)
+        if self._monitor is not None and data:
+            # Any character stops ATMA and is swallowed
+            self._stop_monitor()
+            data = data[1:]
+        self._line += data
+        while (end := self._line.find(b"\r")) >= 0:
+            line = self._line[:end].decode("ascii", errors="replace")
+            del self._line[:end + 1]
+            echo = line.strip() + "\r" if self.echo else ""
+            command = line.replace("\n", "").replace(" ", "").upper()
+            if command.startswith("STBR") and self.stn and command[4:].isdigit():
+                self._start_switch(echo, int(command[4:]))
+                del self._line[:]
+                break
+            if command == "ATMA":
+                self.feed(echo.encode("ascii"))
+                self._start_monitor()
+                del self._line[:]  # Rest of the line would stop monitoring straight away
+                break
+            response = self._command(command)
+            if response is not None:
+                self.feed(f"{echo}{response}\r\r>".encode("ascii"))
+        return len(data)
+
+    def _start_switch(self, echo: str, rate: int):
+        # OK at the old rate, then the ID string at the new one, which the host has 75ms to confirm
+        previous = self._uart
+        self.feed(f"{echo}OK\r".encode("ascii"))
+        self._uart = rate
+        ident = b"ELM327 v1.4b\r" if rate <= self.max_baud else b"\xfe\x13\xb7\x80\r"
+        self.feed(ident)
+
+        def revert():
+            with self._cv:
+                if self._switch is timer:
+                    self._switch = None
+                    self._uart = previous
+                    self.feed(b">")
+
+        timer = threading.Timer(0.075, revert)
+        self._switch = timer
+        timer.start()
+
+    def _confirm_baud(self, data: bytes):
+        with self._cv:
+            timer, self._switch = self._switch, None
+        timer.cancel()
+        if data.startswith(b"\r") and self.baudrate == self._uart <= self.max_baud:
+            self.feed(b"OK\r\r>")
+
+    def _start_monitor(self):
+        stop = threading.Event()
+
+        def run():
+            due = {}
+            while not stop.is_set():
+                now = time.monotonic()
+                for header, ecu in self.ecus.items():
+                    response_id = header + 8
+                    if self.receive_filter is not None and response_id != self.receive_filter:
+                        continue
+                    for identifier, mode in list(ecu.periodic.items()):
+                        if now >= due.get((header, identifier), 0):
+                            due[(header, identifier)] = now + PERIODIC_PERIODS[mode]
+                            frame = (bytes([identifier & 0xFF]) + ecu.value(identifier)).ljust(8, b"\xAA")
+                            sep = " " if self.spaces else ""
+                            self.feed(f"{response_id:03X}{sep}{self._hex(frame)}\r".encode("ascii"))
+                stop.wait(min(PERIODIC_PERIODS.values()) / 2)
+
+        self._monitor = (stop, threading.Thread(target=run, daemon=True))
+        self._monitor[1].start()
+
+    def _stop_monitor(self):
+        stop, thread = self._monitor
+        stop.set()
+        thread.join()
+        self._monitor = None
+        self.feed(b"STOPPED\r\r>")
+
+    def _command(self, line: str) -> str | None:
+        cmd = line.replace(" ", "").upper()
+        if not cmd:
+            return None
+        if cmd.startswith("AT"):
+            return self._at(cmd[2:])
+        if cmd.startswith("ST") and self.stn:
+            return self._st(cmd[2:])
+        count = None
+        if len(cmd) % 2:
+            # Trailing digit: number of responses to wait for
+            cmd, count = cmd[:-1], int(cmd[-1], 16) if cmd[-1] in "123456789ABCDEF" else None
+            if count is None:
+                return "?"
+        try:
+            request = bytes.fromhex(cmd)
+        except ValueError:
+            return "?"
+        if not self.auto_format:
+            return self._frame(self.header, request, count)
+        if not request or len(request) > 7:
+            return "?"
+        return self._request(self.header, request, self.responses, count=count)
+
+    def _at(self, cmd: str) -> str:
+        if cmd in ("Z", "WS"):
+            self.echo, self.spaces, self.header = True, True, 0x7DF
+            self.auto_format, self.responses = True, True
+            self.response_timeout = 0.2
+            return "\rELM327 v1.4b" if cmd == "Z" else "ELM327 v1.4b"
+        if cmd in ("E0", "E1"):
+            self.echo = cmd == "E1"
+        elif cmd in ("S0", "S1"):
+            self.spaces = cmd == "S1"
+        elif cmd in ("CAF0", "CAF1"):
+            self.auto_format = cmd == "CAF1"
+        elif cmd in ("R0", "R1"):
+            self.responses = cmd == "R1"
+        elif cmd.startswith("ST"):
+            try:
+                self.response_timeout = (int(cmd[2:], 16) or 0x32) * 0.004
+            except ValueError:
+                return "?"
+        elif cmd.startswith("CRA"):
+            try:
+                self.receive_filter = int(cmd[3:], 16) if cmd[3:] else None
+            except ValueError:
+                return "?"
+        elif cmd.startswith("SH"):
+            try:
+                self.header = int(cmd[2:], 16)
+            except ValueError:
+                return "?"
+        elif cmd == "RV":
+            return f"{self.voltage:.1f}V"
+        elif cmd == "I":
+            return "ELM327 v1.4b"
+        return "OK"
+
+    def _st(self, cmd: str) -> str:
+        if cmd == "DI":
+            return "OBDLink SX r4.2 (simulated)"
+        if cmd in ("CSEGR0", "CSEGR1"):
+            self.segmentation = cmd == "CSEGR1"
+        elif cmd.startswith("PX"):
+            params = dict(p.split(":", 1) for p in cmd[2:].split(",") if ":" in p)
+            try:
+                header = int(params["H"], 16)
+                request = bytes.fromhex(params["D"])
+            except (KeyError, ValueError):
+                return "?"
+            timeout = int(params["T"]) / 1000 if params.get("T", "").isdigit() else None
+            count = int(params["R"], 16) if params.get("R", "").isalnum() else 1
+            return self._request(header, request, count != 0, timeout, count)
+        return "OK"
+
+    def _request(self, header: int, request: bytes, expect_response: bool, timeout: float | None = None,
+                 count: int | None = None) -> str:
+        timeout = self.response_timeout if timeout is None else timeout
+        if self.timeouts and expect_response and self.latency > timeout:
+            time.sleep(timeout)
+            return "NO DATA"
+        if self.latency:
+            time.sleep(self.latency)
+        ecu = self.ecus.get(header)
+        response = ecu.handle(request) if ecu is not None else None
+        if response is None:
+            if self.timeouts and expect_response:
+                time.sleep(timeout)
+            return "" if not expect_response else "NO DATA"
+        # Response pending: the adapter keeps listening (for `timeout` after each response) until it
+        # has `count` responses, or any number if it wasn't given one
+        pending = []
+        while len(response) == 3 and response[0] == 0x7F and response[2] == 0x78 and \
+                (count is None or len(pending) + 1 < count):
+            wait = ecu.pending_for(request)
+            if wait > timeout:
+                if self.timeouts:
+                    time.sleep(timeout)
+                break
+            time.sleep(wait)
+            pending.append(self._hex(response))
+            response = ecu.handle(request)
+        if pending:
+            return "\r".join(pending + [self._request_lines(response)])
+        return self._request_lines(response)
+
+    def _request_lines(self, response: bytes) -> str:
+        if len(response) <= 7 or self.segmentation:
+            return self._hex(response)
+        # Without segmentation the adapter prints raw ISO-TP frames, as a real ELM327 does with CAF1
+        lines = [f"{len(response):03X}", f"0:{self._hex(response[:6])}"]
+        for n, i in enumerate(range(6, len(response), 7), start=1):
+            lines.append(f"{n % 16:X}:{self._hex(response[i:i+7])}")
+        return "\r".join(lines)
+
+    def _frame(self, header: int, frame: bytes, count: int | None) -> str:
+        # One raw CAN frame from the tester, the ECU's frames in reply printed one per line
+        ecu = self.ecus.get(header)
+        out = []
+        if ecu is not None and frame:
+            out = self._isotp(header, ecu, frame)
+        if not self.responses:
+            return ""
+        if not out:
+            return "NO DATA"
+        return "\r".join(self._hex(f) for f in out[:count])
+
+    def _isotp(self, header: int, ecu: SimulatedECU, frame: bytes) -> list:
+        kind = frame[0] >> 4
+        if kind == FLOW_CONTROL:
+            return self._send_consecutive(header, frame)
+        rx = self._requests.setdefault(header, Reassembler(ecu.network.max_msg_size))
+        try:
+            request = rx.feed(frame)
+        except ISOTPError:
+            del self._requests[header]
+            return [pad(flow_control(OVERFLOW))] if kind == FIRST_FRAME else []
+        fc = pad(flow_control(CONTINUE_TO_SEND, ecu.network.bs, ecu.network.st_min))
+        if request is None:
+            if kind == FIRST_FRAME:
+                self._block[header] = 0
+                return [fc]
+            self._block[header] += 1
+            if ecu.network.bs and self._block[header] == ecu.network.bs:
+                self._block[header] = 0
+                return [fc]
+            return []
+        if self.latency:
+            time.sleep(self.latency)
+        response = ecu.handle(request)
+        if response is None:
+            return []
+        frames = [pad(f) for f in segment(response)]
+        self._pending[header] = frames[1:]
+        return frames[:1]
+
+    def _send_consecutive(self, header: int, frame: bytes) -> list:
+        pending = self._pending.get(header)
+        if not pending:
+            return []
+        fc = parse_flow_control(frame)
+        if fc.status != CONTINUE_TO_SEND:
+            return []
+        n = fc.bs or len(pending)
+        self._pending[header] = pending[n:]
+        return pending[:n]
+
+    def _hex(self, data: bytes) -> str:
+        return (data.hex(" ") if self.spaces else data.hex()).upper()
+
+class RecordingTransport:
+    """Wraps a real port and logs every write and read (with timestamps) to a JSON-lines file."""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self._log = open(path, "w")
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _record(self, kind: str, data: bytes):
+        if data:
+            with self._lock:
+                self._log.write(json.dumps({"t": round(time.monotonic() - self._start, 6), kind: data.hex()}) + "\n")
+
+    def write(self, data: bytes) -> int:
+        self._record("w", data)
+        return self.inner.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.inner.read(size)
+        self._record("r", data)
+        return data
+
+    def read_until(self, expected: bytes = b"\n", size: int | None = None) -> bytes:
+        data = self.inner.read_until(expected, size)
+        self._record("r", data)
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        return self.inner.in_waiting
+
+    @property
+    def timeout(self):
+        return self.inner.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.inner.timeout = value
+
+    @property
+    def is_open(self) -> bool:
+        return self.inner.is_open
+
+    def close(self):
+        self.inner.close()
+        self._log.close()
+
+class ReplayTransport(SerialBuffer):
+    """
+    Plays back a RecordingTransport log. Each write must match the next recorded write, after
+    which the bytes read in response become available, either after their recorded delays
+    (realtime=True) or immediately.
+    """
+
+    def __init__(self, path, realtime: bool = False):
+        super().__init__()
+        self.realtime = realtime
+        self._events = []
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    event = json.loads(line)
+                    kind = "w" if "w" in event else "r"
+                    self._events.append((event["t"], kind, bytes.fromhex(event[kind])))
+        self._pos = 0
+        self._written = bytearray()
+        self._deliver(0.0)  # Anything the adapter sent before the first command
+
+    def write(self, data: bytes) -> int:
+        self._written += data
+        while self._written:
+            if self._pos >= len(self._events) or self._events[self._pos][1] != "w":
+                raise ReplayError(f"Unexpected write {bytes(self._written)!r}, recording has no more commands")
+            t, _, expected = self._events[self._pos]
+            if not (self._written.startswith(expected) or expected.startswith(self._written)):
+                raise ReplayError(f"Expected write {expected!r}, got {bytes(self._written)!r}")
+            if len(self._written) < len(expected):
+                break  # Command split over several writes, wait for the rest
+            del self._written[:len(expected)]
+            self._pos += 1
+            self._deliver(t)
+        return len(data)
+
+    def _deliver(self, since: float):
+        chunks = []
+        while self._pos < len(self._events) and self._events[self._pos][1] == "r":
+            t, _, data = self._events[self._pos]
+            chunks.append((t - since, data))
+            self._pos += 1
+        if not chunks:
+            return
+        if not self.realtime:
+            self.feed(b"".join(data for _, data in chunks))
+            return
+
+        def play():
+            start = time.monotonic()
+            for delay, data in chunks:
+                remaining = delay - (time.monotonic() - start)
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.feed(data)
+
+        threading.Thread(target=play, daemon=True).start()
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import struct
+import time
+from collections import namedtuple
+from mdx import accessible_dids, did_sizes
+from decode import compile_decoders, format_fields
+from dtc import DTCRecord, DTCChange, ADDED, REMOVED, CHANGED
+from capability import LEARNED_NRCS
+from obdlink import CANError
+
+# File layout:
+#   b"FDSNAP" + version byte
+#   u32 length + JSON header: target, part number, session, time taken, digest, identity
+#   u16 record count, records sorted by DID: u16 DID, u8 NRC (0 for a positive response, 0xFF for
+#   no response at all), u16 length, data
+#   u16 DTC count (0xFFFF if they couldn't be read), then DTC (3 bytes) + status per DTC
+# digest is SHA-256 over everything after the header, so equal digests mean equal ECU state.
+
+_MAGIC = b"FDSNAP"
+_SNAPSHOT_VERSION = 1
+_RECORD = struct.Struct(">HBH")
+_NO_DTCS = 0xFFFF
+_NO_RESPONSE = 0xFF  # Reserved by ISO 14229, never sent as an NRC
+
+# Identification DIDs that move whenever the module is reflashed or swapped: software part number,
+# delivery assembly (core + software + calibrations) and serial number
+IDENTITY_DIDS = (0xF188, 0xF113, 0xF18C)
+
+class Snapshot(namedtuple("Snapshot", ["target", "part_number", "session", "taken", "values", "errors", "dtcs"])):
+    """
+    Everything readable from one ECU at one point in time: values {DID: raw bytes}, errors
+    {DID: NRC} for refused DIDs, and dtcs as a tuple of DTCRecords (None if 0x19 failed).
+    """
+    __slots__ = ()
+
+    def body(self) -> bytes:
+        identifiers = sorted(self.values.keys() | self.errors.keys())
+        out = bytearray(len(identifiers).to_bytes(2, "big"))
+        for identifier in identifiers:
+            data = self.values.get(identifier, b"")
+            nrc = 0 if identifier in self.values else _nrc_byte(self.errors[identifier])
+            out += _RECORD.pack(identifier, nrc, len(data))
+            out += data
+        if self.dtcs is None:
+            out += _NO_DTCS.to_bytes(2, "big")
+        else:
+            out += len(self.dtcs).to_bytes(2, "big")
+            for r in sorted(self.dtcs):
+                out += r.number.to_bytes(3, "big") + bytes([r.status])
+        return bytes(out)
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.body()).hexdigest()
+
+    @property
+    def identity(self) -> str:
+        return _identity(self.values, self.errors)
+
+    def save(self, path):
+        body = self.body()
+        header = json.dumps({"target": self.target, "part_number": self.part_number, "session": self.session,
+                             "taken": self.taken, "digest": hashlib.sha256(body).hexdigest(),
+                             "identity": self.identity}).encode()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC + bytes([_SNAPSHOT_VERSION]) + len(header).to_bytes(4, "big") + header + body)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> "Snapshot":
+        with open(path, "rb") as f:
+            blob = f.read()
+        if not blob.startswith(_MAGIC) or blob[len(_MAGIC)] != _SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {_SNAPSHOT_VERSION} snapshot")
+        i = len(_MAGIC) + 1
+        length = int.from_bytes(blob[i:i + 4], "big")
+        header = json.loads(blob[i + 4:i + 4 + length])
+        body = memoryview(blob)[i + 4 + length:]
+        if hashlib.sha256(body).hexdigest() != header["digest"]:
+            raise ValueError(f"{path} doesn't match its digest")
+        values, errors = {}, {}
+        i = 2
+        for _ in range(int.from_bytes(body[:2], "big")):
+            identifier, nrc, size = _RECORD.unpack_from(body, i)
+            i += _RECORD.size
+            if nrc:
+                errors[identifier] = None if nrc == _NO_RESPONSE else nrc
+            else:
+                values[identifier] = bytes(body[i:i + size])
+            i += size
+        count = int.from_bytes(body[i:i + 2], "big")
+        dtcs = None
+        if count != _NO_DTCS:
+            dtcs = tuple(DTCRecord(int.from_bytes(body[j:j + 2], "big"), body[j + 2], body[j + 3])
+                         for j in range(i + 2, i + 2 + 4 * count, 4))
+        return cls(header["target"], header["part_number"], header["session"], header["taken"], values, errors, dtcs)
+
+def _nrc_byte(nrc: int | None) -> int:
+    # errors hold None for DIDs the ECU didn't answer, see UDS.read_data_by_identifiers
+    return _NO_RESPONSE if nrc is None else nrc
+
+def _identity(values: dict, errors: dict) -> str:
+    h = hashlib.sha256()
+    for identifier in IDENTITY_DIDS:
+        nrc = _nrc_byte(errors[identifier]) if identifier in errors else 0
+        h.update(identifier.to_bytes(2, "big") + bytes([nrc]) + values.get(identifier, b""))
+    return h.hexdigest()
+
+def static_dids(parsed_data) -> frozenset:
+    # DIDs that only change with a reflash or a new module: nothing can write them (no WRITEABLE
+    # access) and every field is an ASCII or BCD identification string
+    static = set()
+    for number, info in parsed_data["dids"].items():
+        if not number or "WRITEABLE" in info["access"] or not info["subfields"]:
+            continue
+        if all(sf["data_type"] in ("ascii", "bcd") for sf in info["subfields"]):
+            static.add(int(number, 16))
+    return frozenset(static)
+
+def take_snapshot(diag, target: int, parsed_data, session_ref: str = "session_01",
+                  baseline: Snapshot | None = None, static: frozenset | None = None) -> Snapshot:
+    """
+    Reads every DID the MDX says is readable in `session_ref`, plus the stored DTCs.
+
+    Given a baseline from the same ECU, the identity DIDs are read first. If they hash the same as
+    the baseline's, the module hasn't been reflashed or swapped since, so static DIDs and DIDs it
+    refused for good (see capability.LEARNED_NRCS) are carried over from the baseline unread.
+    """
+    readable = sorted(accessible_dids(parsed_data, session_ref, "service_22", "READABLE"))
+    sizes = did_sizes(parsed_data)
+    max_per_request = parsed_data["protocol"]["max_dids_per_request"]
+    values, errors = {}, {}
+    if baseline is not None and baseline.target == target and baseline.session == session_ref:
+        identity = [i for i in IDENTITY_DIDS if i in readable]
+        values.update(diag.read_data_by_identifiers(target, identity, sizes, max_per_request, errors))
+        if _identity(values, errors) == baseline.identity:
+            static = static_dids(parsed_data) if static is None else static
+            for identifier in static:
+                if identifier in baseline.values and identifier not in values:
+                    values[identifier] = baseline.values[identifier]
+            for identifier, nrc in baseline.errors.items():
+                if nrc in LEARNED_NRCS:
+                    errors[identifier] = nrc
+    remaining = [i for i in readable if i not in values and i not in errors]
+    values.update(diag.read_data_by_identifiers(target, remaining, sizes, max_per_request, errors))
+    try:
+        dtcs = tuple(diag.read_dtc_records(target))
+    except (ValueError, CANError):
+        dtcs = None
+    part = values.get(0xF188)
+    part_number = part.decode("utf-8", errors="replace").rstrip("\x00").strip() if part else None
+    return Snapshot(target, part_number, session_ref, time.time(), values, errors, dtcs)
+
+# old/new are the raw values, None where the DID was refused or absent
+DIDChange = namedtuple("DIDChange", ["identifier", "old", "new"])
+
+SnapshotDiff = namedtuple("SnapshotDiff", ["dids", "dtcs"])
+
+def diff_snapshots(old: Snapshot, new: Snapshot) -> SnapshotDiff:
+    # Only what changed: DIDChanges in DID order, and DTCChanges as dtc.DTCWatcher reports them
+    if old.values == new.values and old.dtcs == new.dtcs:
+        return SnapshotDiff([], [])
+    dids = []
+    for identifier in sorted(old.values.keys() | new.values.keys()):
+        a, b = old.values.get(identifier), new.values.get(identifier)
+        if a != b:
+            dids.append(DIDChange(identifier, a, b))
+    dtcs = []
+    before = {r.number: r for r in old.dtcs or ()}
+    after = {r.number: r for r in new.dtcs or ()}
+    for number, record in after.items():
+        previous = before.get(number)
+        if previous is None:
+            dtcs.append(DTCChange(ADDED, record, None))
+        elif previous.status != record.status:
+            dtcs.append(DTCChange(CHANGED, record, previous.status))
+    for number, previous in before.items():
+        if number not in after:
+            dtcs.append(DTCChange(REMOVED, previous, previous.status))
+    return SnapshotDiff(dids, dtcs)
+
+def format_diff(diff: SnapshotDiff, parsed_data=None, decoders: dict | None = None) -> list:
+    # Lines for printing, values decoded through the MDX where it describes them
+    if decoders is None and parsed_data is not None:
+        decoders = compile_decoders(parsed_data)
+    decoders = decoders or {}
+    names = {int(n, 16): info["name"] for n, info in parsed_data["dids"].items() if n} if parsed_data else {}
+
+    def show(identifier, raw):
+        if raw is None:
+            return "-"
+        decoder = decoders.get(identifier)
+        if decoder is not None and decoder.fields:
+            try:
+                return format_fields(decoder.decode(raw))
+            except (ValueError, IndexError):
+                pass
+        return raw.hex().upper()
+
+    lines = []
+    for change in diff.dids:
+        name = names.get(change.identifier, "")
+        lines.append(f"0x{change.identifier:04X} ({name}): {show(change.identifier, change.old)} -> "
+                     f"{show(change.identifier, change.new)}")
+    for change in diff.dtcs:
+        lines.append(f"{change.record.code} {change.kind}: status 0x{change.record.status:02X}")
+    return lines
+
+if __name__ == "__main__":
+    import sys
+    from mdx import load_mdx
+    from obdlink import OBDLink, UDS
+    if len(sys.argv) < 4 or sys.argv[1] not in ("take", "diff"):
+        print(f"Usage: {sys.argv[0]} take <mdx_file> <port> <out_file> [--baseline <snapshot>]")
+        print(f"       {sys.argv[0]} diff <mdx_file> <old_snapshot> [<new_snapshot> | <port>]")
+        sys.exit(1)
+    parsed = load_mdx(sys.argv[2])
+    if sys.argv[1] == "diff" and len(sys.argv) > 4 and os.path.isfile(sys.argv[4]):
+        old, new = Snapshot.load(sys.argv[3]), Snapshot.load(sys.argv[4])
+    else:
+        port = sys.argv[3] if sys.argv[1] == "take" else sys.argv[4]
+        baseline = Snapshot.load(sys.argv[3]) if sys.argv[1] == "diff" else None
+        if "--baseline" in sys.argv:
+            baseline = Snapshot.load(sys.argv[sys.argv.index("--baseline") + 1])
+        elm = OBDLink(port)
+        elm.connect()
+        elm.defaults()
+        elm.configure_isotp(parsed["protocol"]["network"])
+        try:
+            new = take_snapshot(UDS(elm), 0x716, parsed, baseline=baseline)
+        finally:
+            elm.disconnect()
+        if sys.argv[1] == "take":
+            new.save(sys.argv[4])
+            print(f"{len(new.values)} DIDs, {len(new.dtcs or ())} DTCs, digest {new.digest[:16]}")
+            sys.exit(0)
+        old = baseline
+    lines = format_diff(diff_snapshots(old, new), parsed)
+    print("\n".join(lines) if lines else "No changes")
@@ -0,0 +1,151 @@
+import threading
+from collections import namedtuple
+
+# One per adapter command (kind AT/ST/STPX/OBD) and one per UDS request (kind "UDS 22" etc.).
+# phases is (write, echo, prompt, parse) seconds for adapter commands, None for UDS requests.
+CommandTiming = namedtuple("CommandTiming", ["kind", "target", "command", "seconds", "phases", "nrc"])
+
+PHASES = ("write", "echo", "prompt", "parse")
+
+def command_kind(command: str) -> str:
+    c = command[:4].upper()
+    if c == "STPX":
+        return "STPX"
+    if c.startswith(("AT", "ST")):
+        return c[:2]
+    return "OBD"
+
+def stpx_target(command: str) -> int | None:
+    # Header out of "STPXh:0716,d:...", the only adapter command that names its target
+    for part in command[4:].split(","):
+        if part[:2].lower() == "h:":
+            try:
+                return int(part[2:], 16)
+            except ValueError:
+                return None
+    return None
+
+class _Histogram:
+    # Latencies bucketed by power of two microseconds: bucket b holds [2**(b-1), 2**b) us
+    __slots__ = ("count", "total", "min", "max", "buckets", "phases", "nrcs")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * 40
+        self.phases = [0.0] * len(PHASES)
+        self.nrcs = {}
+
+    def percentile(self, q: float) -> float:
+        # Upper edge of the bucket holding the q-th sample, good to a factor of two
+        target = q * self.count
+        seen = 0
+        for b, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min((1 << b) / 1e6, self.max)
+        return self.max
+
+class LatencyStats:
+    """
+    Adapter hook collecting latency histograms per (kind, target).
+
+        stats = LatencyStats()
+        elm.hooks.append(stats)
+        ...
+        print(stats.report())
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: CommandTiming):
+        us = int(event.seconds * 1e6)
+        with self._lock:
+            h = self.histograms.get((event.kind, event.target))
+            if h is None:
+                h = self.histograms[(event.kind, event.target)] = _Histogram()
+            h.count += 1
+            h.total += event.seconds
+            h.min = min(h.min, event.seconds)
+            h.max = max(h.max, event.seconds)
+            h.buckets[min(us.bit_length(), 39)] += 1
+            if event.phases is not None:
+                for i, t in enumerate(event.phases):
+                    h.phases[i] += t
+            if event.nrc is not None:
+                h.nrcs[event.nrc] = h.nrcs.get(event.nrc, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def report(self) -> str:
+        with self._lock:
+            rows = sorted(self.histograms.items(), key=lambda kv: kv[1].total, reverse=True)
+        if not rows:
+            return "No commands timed"
+        lines = [f"{'kind':8} {'target':>6} {'count':>6} {'total':>9} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"]
+        for (kind, target), h in rows:
+            t = f"{target:X}" if target is not None else "-"
+            lines.append(f"{kind:8} {t:>6} {h.count:>6} {_ms(h.total):>9} {_ms(h.total / h.count):>9} "
+                         f"{_ms(h.percentile(0.5)):>9} {_ms(h.percentile(0.9)):>9} {_ms(h.percentile(0.99)):>9} {_ms(h.max):>9}")
+        phased = [(kind, target, h) for (kind, target), h in rows if any(h.phases)]
+        if phased:
+            lines.append("")
+            lines.append("Time per phase (share of adapter command time):")
+            for kind, target, h in phased:
+                total = sum(h.phases) or 1
+                shares = "  ".join(f"{name} {_ms(t)} ({t / total:.0%})" for name, t in zip(PHASES, h.phases))
+                lines.append(f"  {kind:8} {shares}")
+        nrcs = [(kind, target, h.nrcs) for (kind, target), h in rows if h.nrcs]
+        if nrcs:
+            lines.append("")
+            lines.append("Negative responses:")
+            for kind, target, counts in nrcs:
+                t = f"{target:X}" if target is not None else "-"
+                lines.append(f"  {kind:8} {t:>6} " + ", ".join(f"0x{nrc:02X} x{n}" for nrc, n in sorted(counts.items())))
+        return "\n".join(lines)
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1e3:.2f}ms"
+
+class AdaptiveTimeout:
+    """
+    Per-target response timeout learned from observed request latency, the way TCP learns its
+    retransmission timeout (RFC 6298): smoothed latency plus four mean deviations. It's kept
+    between `floor` and `ceiling`, the longest the ECU is allowed to take (P2_MAX + DELTA_P2).
+    Targets nothing has been heard from yet get the ceiling.
+    """
+
+    def __init__(self, ceiling: float, floor: float = 0.02):
+        self.ceiling = ceiling
+        self.floor = min(floor, ceiling)
+        self._estimates = {}  # target -> [smoothed latency, mean deviation]
+        self._lock = threading.Lock()
+
+    def observe(self, target, seconds: float):
+        with self._lock:
+            e = self._estimates.get(target)
+            if e is None:
+                self._estimates[target] = [seconds, seconds / 2]
+            else:
+                e[1] = 0.75 * e[1] + 0.25 * abs(e[0] - seconds)
+                e[0] = 0.875 * e[0] + 0.125 * seconds
+
+    def timeout(self, target) -> float:
+        with self._lock:
+            e = self._estimates.get(target)
+        if e is None:
+            return self.ceiling
+        return max(self.floor, min(self.ceiling, e[0] + 4 * e[1]))
+
+    def forget(self, target=None):
+        with self._lock:
+            if target is None:
+                self._estimates.clear()
+            else:
+                self._estimates.pop(target, None)